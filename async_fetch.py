@@ -0,0 +1,201 @@
+###########################
+# This script fetches osu! maps like fetch_maps.py, but downloads them with asyncio instead of threads.
+# Hundreds of downloads can be in flight at once without a thread stack each.
+# Archives are streamed in chunks (kept in memory, spilling to disk when large) and then go through
+# the same skip/validate/rename logic as fetch_maps.fetch_map.
+###########################
+
+# Python library imports
+import os
+import random
+import asyncio
+import tempfile
+import threading
+from urllib.parse import urlsplit
+import aiohttp
+
+# import config
+import config
+import fetch_maps
+import http_session
+import download_manifest
+import instrumentation
+from instrumentation import log, stats
+
+# file-specific configurations!!
+MAX_CONCURRENCY = 200 #number of downloads in flight at the same time (fewer near the end, so the target is not overshot by much)
+REQUESTS_PER_SECOND = 20 #requests started per second, per host
+CHUNK_SIZE = 1 << 16 #bytes read from the network at a time
+SPOOL_MAX_SIZE = 8 << 20 #archives bigger than this are spilled to a temporary file
+
+
+# Rate limiter that spaces out the requests sent to each host
+class HostRateLimiter:
+
+    def __init__(self, requests_per_second = REQUESTS_PER_SECOND):
+        self.interval = 1.0 / requests_per_second
+        self.next_slot = {}
+
+    async def wait(self, host):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+
+        # book the next free slot for this host (no await in between, so no lock is needed)
+        slot = max(now, self.next_slot.get(host, now))
+        self.next_slot[host] = slot + self.interval
+
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+# Function to get how long to wait before retrying a response
+def retry_delay(response, attempt):
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after is not None and retry_after.isdigit():
+        return min(int(retry_after), http_session.BACKOFF_MAX)
+
+    delay = http_session.BACKOFF_FACTOR * (2 ** attempt) + random.uniform(0, http_session.BACKOFF_JITTER)
+    return min(delay, http_session.BACKOFF_MAX)
+
+
+# Function to download the archive of a beatmapset (returns a file object, or None if the download failed)
+async def download_map_async(http, map_id, limiter):
+    url = os.path.join(config.api_link, map_id)
+    host = urlsplit(url).netloc
+
+    start = asyncio.get_running_loop().time()
+    for attempt in range(http_session.MAX_RETRIES + 1):
+        await limiter.wait(host)
+        try:
+            async with http.get(url) as response:
+                if response.status in http_session.RETRY_STATUSES and attempt < http_session.MAX_RETRIES:
+                    await asyncio.sleep(retry_delay(response, attempt))
+                    continue
+
+                if response.status != 200:
+                    stats.count("download.failed")
+                    log.warning(f'Failed to fetch map {map_id} - got status code {response.status}')
+                    fetch_maps.manifest.record(map_id, download_manifest.FAILED, rejections={"download": f'got status code {response.status}'})
+                    return None
+
+                # stream the archive in chunks
+                archive = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    archive.write(chunk)
+                    stats.count("download.bytes", len(chunk))
+                archive.seek(0)
+
+                # latency includes retries and rate limiting, like the threaded fetcher
+                stats.observe("download.latency", asyncio.get_running_loop().time() - start)
+                stats.count("download.ok")
+                log.debug(f'Successfully fetched map {map_id}!')
+                return archive
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt < http_session.MAX_RETRIES:
+                await asyncio.sleep(retry_delay(None, attempt))
+                continue
+            stats.count("download.failed")
+            log.warning(f'Failed to fetch map {map_id} - {type(e).__name__}: {e}')
+            fetch_maps.manifest.record(map_id, download_manifest.FAILED, rejections={"download": f'{type(e).__name__}: {e}'})
+            return None
+
+    return None
+
+
+# Fetcher function to fetch a map (same checks as fetch_maps.fetch_map)
+async def fetch_map_async(http, map_id, limiter, difficulty_threshold = 5.0):
+
+    # Check if that map was already handled (accepted or fully rejected)
+    if fetch_maps.manifest.is_done(map_id, difficulty_threshold):
+        return 0
+
+    archive = await download_map_async(http, map_id, limiter)
+    if archive is None:
+        return 0
+
+    # validating and writing the .osu files is blocking work, keep it off the event loop
+    try:
+        return await asyncio.to_thread(fetch_maps.extract_map, map_id, archive, difficulty_threshold)
+    finally:
+        archive.close()
+
+
+# Function to fetch maps with asyncio!
+async def fetch_maps_async(num_maps = 100, difficulty_threshold = 5.0, concurrency = MAX_CONCURRENCY, requests_per_second = REQUESTS_PER_SECOND):
+    fetch_maps.open_outputs()
+    manifest = fetch_maps.manifest
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = HostRateLimiter(requests_per_second)
+    tasks = set()
+    progress = instrumentation.Progress("Maps accepted", num_maps)
+    accepted_before = manifest.accepted_count()
+    finished = [0] # sets downloaded (or failed) in this run
+
+    # Difficulties a set in flight is expected to add (1 until a set finishes)
+    def expected_per_set():
+        if finished[0] == 0:
+            return 1
+        return (manifest.accepted_count() - accepted_before) / finished[0]
+
+    # Called when a download finishes
+    def done(task):
+        tasks.discard(task)
+        finished[0] += 1
+        semaphore.release()
+        if not task.cancelled() and task.exception() is not None:
+            log.error(f'Failed to fetch map - {type(task.exception()).__name__}: {task.exception()}')
+        progress.update(done=manifest.accepted_count())
+
+    timeout = aiohttp.ClientTimeout(sock_connect=http_session.CONNECT_TIMEOUT, sock_read=http_session.READ_TIMEOUT)
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=concurrency)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as http:
+
+        # the search API client is blocking, so pages are fetched in a thread
+        stop = threading.Event()
+        search = fetch_maps.search_map_ids(stop)
+
+        while manifest.accepted_count() < num_maps:
+            # only start another set if the sets in flight are not expected to reach the target already
+            # (each is expected to add as many difficulties as the sets finished so far did on average)
+            while tasks and manifest.accepted_count() + len(tasks) * expected_per_set() >= num_maps:
+                await asyncio.wait(set(tasks), return_when=asyncio.FIRST_COMPLETED)
+            if manifest.accepted_count() >= num_maps:
+                break
+
+            map_id = await asyncio.to_thread(next, search, None)
+            if map_id is None:
+                break
+
+            # sets handled in an earlier run are skipped here, so they don't count as finished sets
+            if manifest.is_done(map_id, difficulty_threshold):
+                stats.count("download.skipped")
+                continue
+
+            # wait for a free download slot
+            await semaphore.acquire()
+            if manifest.accepted_count() >= num_maps:
+                semaphore.release()
+                break
+
+            task = asyncio.create_task(fetch_map_async(http, map_id, limiter, difficulty_threshold))
+            tasks.add(task)
+            task.add_done_callback(done)
+
+        stop.set()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    log.info(f'Successfully fetched {manifest.accepted_count()} maps! ({manifest.summary()})')
+
+
+# Main function...that's it
+if __name__ == "__main__":
+
+    # create maps folder if it does not exist
+    if not os.path.exists(config.map_folder):
+        os.makedirs(config.map_folder)
+
+    instrumentation.setup_logging()
+    with instrumentation.instrumented_run("async_fetch", fetch_maps.STATS_FILE):
+        asyncio.run(fetch_maps_async(fetch_maps.NUM_MAPS))
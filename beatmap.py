@@ -0,0 +1,89 @@
+###########################
+# This module holds the columnar representation of a parsed osu! map.
+# Hit objects and timing points are stored as typed NumPy arrays instead of one dict per object,
+# and every other stage (features, clustering inputs, ...) works on this container.
+###########################
+
+# Python library imports
+import numpy as np
+import osu_parser
+
+# Hit object type flags
+HIT_CIRCLE = 1
+SLIDER = 2
+SPINNER = 8
+
+# Sections needed to build a Beatmap
+BEATMAP_SECTIONS = ["Difficulty", "TimingPoints", "HitObjects"]
+
+
+class Beatmap:
+    __slots__ = ("x", "y", "time", "type", "tp_time", "beat_length", "meter", "difficulty")
+
+    def __init__(self, x, y, time, type, tp_time, beat_length, meter, difficulty = None):
+        # hit objects
+        self.x = np.asarray(x, dtype=np.int16)
+        self.y = np.asarray(y, dtype=np.int16)
+        self.time = np.asarray(time, dtype=np.int32)
+        self.type = np.asarray(type, dtype=np.uint8)
+
+        # timing points
+        self.tp_time = np.asarray(tp_time, dtype=np.float64)
+        self.beat_length = np.asarray(beat_length, dtype=np.float64)
+        self.meter = np.asarray(meter, dtype=np.int16)
+
+        # difficulty stats (raw strings, as they appear in the file)
+        self.difficulty = difficulty if difficulty is not None else {}
+
+    def __len__(self):
+        return len(self.time)
+
+    @property
+    def is_hitcircle(self):
+        return (self.type & HIT_CIRCLE) != 0
+
+    @property
+    def is_slider(self):
+        return (self.type & SLIDER) != 0
+
+    @property
+    def is_spinner(self):
+        return (self.type & SPINNER) != 0
+
+    # Distance between each pair of consecutive hit objects
+    def spacing(self):
+        dx = np.diff(self.x.astype(np.float64))
+        dy = np.diff(self.y.astype(np.float64))
+        return np.hypot(dx, dy)
+
+    # Time between each pair of consecutive hit objects (in ms)
+    def time_diffs(self):
+        return np.diff(self.time)
+
+    # Approximate memory used by the arrays (in bytes)
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self.__slots__ if name != "difficulty")
+
+    # Build a Beatmap from the output of osu_parser.parse_sections
+    @classmethod
+    def from_sections(cls, sections):
+        timing_rows = sections.get("TimingPoints", [])
+        hit_rows = sections.get("HitObjects", [])
+        n_tp = len(timing_rows)
+        n_hits = len(hit_rows)
+
+        return cls(
+            x = np.fromiter((int(row[0]) for row in hit_rows), dtype=np.int16, count=n_hits),
+            y = np.fromiter((int(row[1]) for row in hit_rows), dtype=np.int16, count=n_hits),
+            time = np.fromiter((int(row[2]) for row in hit_rows), dtype=np.int32, count=n_hits),
+            type = np.fromiter((int(row[3]) for row in hit_rows), dtype=np.uint8, count=n_hits),
+            tp_time = np.fromiter((float(row[0]) for row in timing_rows), dtype=np.float64, count=n_tp),
+            beat_length = np.fromiter((float(row[1]) for row in timing_rows), dtype=np.float64, count=n_tp),
+            meter = np.fromiter((int(row[2]) for row in timing_rows), dtype=np.int16, count=n_tp),
+            difficulty = sections.get("Difficulty", {}),
+        )
+
+
+# Function to load a .osu file (path or raw bytes) into a Beatmap
+def load_beatmap(map_file):
+    return Beatmap.from_sections(osu_parser.parse_osu(map_file, BEATMAP_SECTIONS))
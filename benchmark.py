@@ -0,0 +1,287 @@
+###########################
+# This script benchmarks every stage of the pipeline on generated data (see synthetic_maps.py):
+# parsing, feature computation, folder extraction, fetch-side archive filtering, clustering and feature file loading.
+# Nothing here needs the real corpus or network access, everything is written to a temporary folder
+# (the archive benchmark imports fetch_maps, so it still needs a config file).
+# Results can be saved to a JSON file and compared with the results of another version (see --help).
+###########################
+
+# Python library imports
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import zipfile
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+import osu_parser
+import beatmap
+import feature_extraction
+import feature_io
+import synthetic_maps
+
+# File-specific configurations
+BENCHMARKS = ["parse", "features", "folder", "archives", "cluster", "loading"]
+
+MAP_SIZES = [100, 1000, 10000] # hit objects per map, for parsing and feature computation
+MAPS_PER_SIZE = 50 # maps timed at each size
+MAP_COUNTS = [1000, 2000, 5000, 10000, 20000] # corpus sizes to time folder extraction on
+ARCHIVE_COUNTS = [100, 500] # beatmapset archives to filter
+CLUSTER_ROWS = [10000, 100000] # rows of the feature table to cluster
+CLUSTER_ALGORITHMS = ["kmeans", "minibatch-kmeans", "dbscan"]
+HIT_OBJECTS_PER_MAP = 200
+SEED = 0
+
+FEATURE_ROWS = 500000 # rows in the feature table used to compare file formats
+
+# Results slower than the baseline by more than this factor are flagged by --compare
+REGRESSION_THRESHOLD = 1.10
+
+
+# Function to time a function over a list of inputs (returns the total seconds)
+def time_each(function, inputs):
+    start = time.perf_counter()
+    for item in inputs:
+        function(item)
+    return time.perf_counter() - start
+
+
+# Function to make a benchmark result (per_item is the time per map/row/archive in ms)
+def result(benchmark, size, seconds, items, **extra):
+    row = {"benchmark": benchmark, "size": size, "seconds": seconds, "items": items, "per_item_ms": seconds / items * 1000}
+    row.update(extra)
+    print(f"{benchmark:>24} {size:>8}: {seconds:8.3f}s ({row['per_item_ms']:.3f} ms/item)")
+    return row
+
+
+# Function to time parsing maps of each size, from a file and from bytes already in memory
+def bench_parsing(map_sizes = MAP_SIZES, maps_per_size = MAPS_PER_SIZE):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in map_sizes:
+            files = []
+            for n in range(maps_per_size):
+                files.append(os.path.join(tmp, f"{size}_{n}.osu"))
+                synthetic_maps.write_map(files[-1], hit_objects=size, timing_points=4, inherited_points=20, seed=n)
+            buffers = []
+            for map_file in files:
+                with open(map_file, "rb") as f:
+                    buffers.append(f.read())
+
+            results.append(result("parse.file", size, time_each(osu_parser.parse_osu, files), len(files)))
+            results.append(result("parse.bytes", size, time_each(osu_parser.parse_osu, buffers), len(buffers)))
+            results.append(result("parse.beatmap", size, time_each(beatmap.load_beatmap, files), len(files)))
+    return results
+
+
+# Function to time extract_features on maps of each size, one map at a time and as one batch
+def bench_feature_computation(map_sizes = MAP_SIZES, maps_per_size = MAPS_PER_SIZE):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in map_sizes:
+            files = []
+            for n in range(maps_per_size):
+                files.append(os.path.join(tmp, f"{size}_{n}.osu"))
+                synthetic_maps.write_map(files[-1], hit_objects=size, timing_points=4, inherited_points=20, seed=n)
+
+            results.append(result("features", size, time_each(feature_extraction.extract_features, files), len(files)))
+            results.append(result("features.batch", size, time_each(feature_extraction.extract_features_batch, [files]), len(files)))
+    return results
+
+
+# Function to time extract_features_from_folder for each corpus size
+# the time per map should stay flat as the corpus grows
+def bench_folder_extraction(map_counts = MAP_COUNTS, workers = 1):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        maps_path = os.path.join(tmp, "maps")
+        written = 0
+
+        for count in map_counts:
+            # grow the same folder instead of starting from scratch
+            synthetic_maps.write_corpus(maps_path, count, start=written, hit_objects=HIT_OBJECTS_PER_MAP)
+            written = max(written, count)
+
+            start = time.perf_counter()
+            feature_extraction.extract_features_from_folder(maps_path, workers=workers, output_file=os.path.join(tmp, "features.csv"), use_cache=False)
+            elapsed = time.perf_counter() - start
+
+            results.append(result("folder", count, elapsed, count, workers=workers))
+
+    return results
+
+
+# Function to time the fetcher's archive filtering (check_difficulty) and extraction (extract_map) on local archives
+# fetch_maps is pointed at a temporary map store and manifest, nothing is downloaded
+def bench_archive_filtering(archive_counts = ARCHIVE_COUNTS):
+    import fetch_maps
+    import map_store
+    import download_manifest
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        store, manifest = fetch_maps.store, fetch_maps.manifest
+        try:
+            for count in archive_counts:
+                archives = [synthetic_maps.generate_archive(synthetic_maps.typical_difficulties(seed=n), seed=n) for n in range(count)]
+
+                # only the checks: read the headers of every difficulty
+                def check(content):
+                    with zipfile.ZipFile(io.BytesIO(content)) as zip_file:
+                        for file in zip_file.namelist():
+                            if file.endswith(".osu"):
+                                fetch_maps.check_difficulty(zip_file, file)
+                results.append(result("archives.check", count, time_each(check, archives), count))
+
+                # checks, writing the accepted difficulties and recording the outcome
+                fetch_maps.store = map_store.open_store(os.path.join(tmp, f"maps_{count}"))
+                fetch_maps.manifest = download_manifest.Manifest(os.path.join(tmp, f"manifest_{count}.sqlite"))
+                start = time.perf_counter()
+                for n, content in enumerate(archives):
+                    fetch_maps.extract_map(str(n), content)
+                elapsed = time.perf_counter() - start
+                fetch_maps.manifest.close()
+                results.append(result("archives.extract", count, elapsed, count))
+        finally:
+            fetch_maps.store, fetch_maps.manifest = store, manifest
+
+    return results
+
+
+# Function to time clustering a feature table of each size with each algorithm
+def bench_clustering(row_counts = CLUSTER_ROWS, algorithms = CLUSTER_ALGORITHMS, seed = SEED):
+    import create_clusters
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in row_counts:
+            rng = np.random.default_rng(seed)
+            df = pd.DataFrame({"map_id": [f"{i}_0.osu" for i in range(rows)], "overall_difficulty": rng.uniform(5.5, 10, rows)})
+            for f in feature_extraction.FEATURES:
+                if f != "overall_difficulty":
+                    df[f] = rng.random(rows)
+            path = os.path.join(tmp, f"features_{rows}.npz")
+            feature_io.write_features(df, path)
+
+            for algorithm in algorithms:
+                args = ["--input", path, "--algorithm", algorithm, "--no-plot", "--log-level", "WARNING",
+                        "--report-dir", os.path.join(tmp, f"report_{rows}_{algorithm}")]
+                start = time.perf_counter()
+                create_clusters.main(args)
+                results.append(result(f"cluster.{algorithm}", rows, time.perf_counter() - start, rows))
+
+    return results
+
+
+# Function to time writing and loading a feature table in every supported format
+def bench_feature_loading(rows = FEATURE_ROWS, seed = SEED):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({"map_id": [f"{i}_0.osu" for i in range(rows)]})
+    for f in feature_extraction.FEATURES:
+        df[f] = rng.random(rows)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for ext in sorted(feature_io.FORMATS):
+            path = os.path.join(tmp, "features" + ext)
+            try:
+                start = time.perf_counter()
+                feature_io.write_features(df, path)
+                write_time = time.perf_counter() - start
+            except ImportError as e:
+                print(f"{'loading' + ext:>24}: skipped ({e})")
+                continue
+
+            start = time.perf_counter()
+            feature_io.read_features(path)
+            read_time = time.perf_counter() - start
+
+            size = os.path.getsize(path)
+            results.append(result("write" + ext, rows, write_time, rows, bytes=size))
+            results.append(result("load" + ext, rows, read_time, rows, bytes=size))
+
+    return results
+
+
+# Function to describe what the benchmarks ran on (stored with the results)
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+            "machine": platform.machine(), "cpus": os.cpu_count(), "time": time.strftime("%Y-%m-%d %H:%M:%S")}
+
+
+# Function to print how the results compare with an earlier run (ratio > 1 means slower now)
+# returns the benchmarks that got slower than REGRESSION_THRESHOLD
+def compare(baseline, results, threshold = REGRESSION_THRESHOLD):
+    before = {(r["benchmark"], r["size"]): r["seconds"] for r in baseline["results"]}
+    regressions = []
+    print(f"\nCompared with {baseline['environment'].get('commit')} ({baseline['environment'].get('time')}):")
+    for r in results:
+        key = (r["benchmark"], r["size"])
+        if key not in before or before[key] == 0:
+            continue
+        ratio = r["seconds"] / before[key]
+        flag = " <- slower" if ratio > threshold else ""
+        print(f"{r['benchmark']:>24} {r['size']:>8}: {before[key]:8.3f}s -> {r['seconds']:8.3f}s ({ratio:.2f}x){flag}")
+        if ratio > threshold:
+            regressions.append(key)
+    return regressions
+
+
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(description="Benchmark the osu! analyzer pipeline on generated maps.")
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=BENCHMARKS, help="benchmarks to run (default: all)")
+    parser.add_argument("--map-sizes", type=int, nargs="+", default=MAP_SIZES, help="parse, features: hit objects per map")
+    parser.add_argument("--maps-per-size", type=int, default=MAPS_PER_SIZE)
+    parser.add_argument("--map-counts", type=int, nargs="+", default=MAP_COUNTS, help="folder: corpus sizes")
+    parser.add_argument("--workers", type=int, default=1, help="folder: extraction worker processes")
+    parser.add_argument("--archive-counts", type=int, nargs="+", default=ARCHIVE_COUNTS, help="archives: beatmapsets to filter")
+    parser.add_argument("--cluster-rows", type=int, nargs="+", default=CLUSTER_ROWS, help="cluster: rows of the feature table")
+    parser.add_argument("--algorithms", nargs="+", default=CLUSTER_ALGORITHMS, help="cluster: algorithms to time")
+    parser.add_argument("--feature-rows", type=int, default=FEATURE_ROWS, help="loading: rows of the feature table")
+    parser.add_argument("--output", default=None, help="save the results to this JSON file")
+    parser.add_argument("--compare", default=None, help="JSON file of an earlier run to compare with")
+    return parser.parse_args(argv)
+
+
+def main(argv = None):
+    args = parse_args(argv)
+    selected = args.only
+
+    results = []
+    if "parse" in selected:
+        results += bench_parsing(args.map_sizes, args.maps_per_size)
+    if "features" in selected:
+        results += bench_feature_computation(args.map_sizes, args.maps_per_size)
+    if "folder" in selected:
+        results += bench_folder_extraction(args.map_counts, args.workers)
+    if "archives" in selected:
+        results += bench_archive_filtering(args.archive_counts)
+    if "cluster" in selected:
+        results += bench_clustering(args.cluster_rows, args.algorithms)
+    if "loading" in selected:
+        results += bench_feature_loading(args.feature_rows)
+
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"environment": environment(), "results": results}, f, indent=2)
+        print(f"Wrote results to {args.output}")
+
+    if args.compare is not None:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(baseline, results):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+###########################
+# This module writes the report of a clustering run to files (nothing is ever shown on screen).
+# Per-cluster sizes, feature means and standard deviations are accumulated chunk by chunk,
+# and the pair plot is drawn from a capped, stratified per-cluster sample instead of every row.
+###########################
+
+# Python library imports
+import os
+import json
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use("Agg") # non-interactive backend, works on headless machines
+from matplotlib import pyplot as plt
+
+# File-specific configurations
+PLOT_POINTS = 5000 # most points drawn in the pair plot (split evenly between clusters)
+NOISE_CLUSTER = -1 # label used by dbscan for points that belong to no cluster
+
+
+class ClusterReport:
+
+    def __init__(self, feature_names, plot_points = PLOT_POINTS, seed = 0):
+        self.feature_names = list(feature_names)
+        self.plot_points = plot_points
+        self.rng = np.random.default_rng(seed)
+
+        # per-cluster running totals
+        self.counts = {}
+        self.sums = {}
+        self.squares = {}
+
+        # per-cluster sample (rows with the smallest random keys are kept, so it stays uniform)
+        self.samples = {}
+
+    # Function to add a chunk of rows and their clusters to the report
+    def add(self, X, clusters):
+        X = np.asarray(X, dtype=np.float64)
+        clusters = np.asarray(clusters)
+        keys = self.rng.random(len(X))
+
+        for cluster in np.unique(clusters):
+            cluster = int(cluster)
+            mask = clusters == cluster
+            rows = X[mask]
+
+            self.counts[cluster] = self.counts.get(cluster, 0) + len(rows)
+            self.sums[cluster] = self.sums.get(cluster, 0) + rows.sum(axis=0)
+            self.squares[cluster] = self.squares.get(cluster, 0) + (rows ** 2).sum(axis=0)
+
+            # merge with the kept sample and keep at most plot_points rows of this cluster
+            sample_keys, sample_rows = self.samples.get(cluster, (np.zeros(0), np.zeros((0, X.shape[1]))))
+            sample_keys = np.concatenate([sample_keys, keys[mask]])
+            sample_rows = np.concatenate([sample_rows, rows])
+            if len(sample_keys) > self.plot_points:
+                keep = np.argpartition(sample_keys, self.plot_points)[:self.plot_points]
+                sample_keys, sample_rows = sample_keys[keep], sample_rows[keep]
+            self.samples[cluster] = (sample_keys, sample_rows)
+
+    # Function to get the per-cluster summary (size, share of rows, feature means and standard deviations)
+    def summary(self):
+        total = sum(self.counts.values())
+        rows = []
+        for cluster in sorted(self.counts):
+            count = self.counts[cluster]
+            mean = self.sums[cluster] / count
+            std = np.sqrt(np.maximum(self.squares[cluster] / count - mean ** 2, 0))
+
+            row = {"cluster": cluster, "size": count, "share": count / total}
+            row.update({f"{name}_mean": value for name, value in zip(self.feature_names, mean)})
+            row.update({f"{name}_std": value for name, value in zip(self.feature_names, std)})
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    # Function to get the stratified sample drawn in the plot (noise left out, same cap for every cluster)
+    def plot_sample(self):
+        clusters = [c for c in sorted(self.samples) if c != NOISE_CLUSTER]
+        if len(clusters) == 0:
+            return pd.DataFrame(columns=self.feature_names + ["cluster"])
+
+        per_cluster = max(1, self.plot_points // len(clusters))
+        frames = []
+        for cluster in clusters:
+            sample_keys, sample_rows = self.samples[cluster]
+            keep = np.argsort(sample_keys)[:per_cluster]
+            frame = pd.DataFrame(sample_rows[keep], columns=self.feature_names)
+            frame["cluster"] = cluster
+            frames.append(frame)
+        return pd.concat(frames, ignore_index=True)
+
+    # Function to write the report (summary.csv, report.json and, unless plot is False, pairplot.png)
+    def write(self, report_dir, plot = True, extra = None):
+        os.makedirs(report_dir, exist_ok=True)
+
+        summary = self.summary()
+        summary.to_csv(os.path.join(report_dir, "summary.csv"), index=False)
+
+        report = {
+            "rows": int(sum(self.counts.values())),
+            "features": self.feature_names,
+            "clusters": {
+                str(row["cluster"]): {
+                    "size": int(row["size"]),
+                    "share": float(row["share"]),
+                    "centroid": {name: float(row[f"{name}_mean"]) for name in self.feature_names},
+                    "std": {name: float(row[f"{name}_std"]) for name in self.feature_names},
+                }
+                for row in summary.to_dict("records")
+            },
+        }
+        if extra is not None:
+            report.update(extra)
+        with open(os.path.join(report_dir, "report.json"), "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+        if plot:
+            sample = self.plot_sample()
+            if len(sample) > 0:
+                import seaborn as sns
+                grid = sns.pairplot(sample, hue="cluster")
+                grid.savefig(os.path.join(report_dir, "pairplot.png"))
+                plt.close("all")
+
+        return summary
@@ -1,63 +1,230 @@
 ###########################
 # This script will take extracted features and cluster them.
 # The directories to each section can be edited in the config file.
+# The clustering algorithm and its settings are picked on the command line (see --help).
+# With --chunked, the feature file is streamed in blocks so memory stays bounded however many maps there are.
+# The results are written to a report folder (cluster summary + sampled pair plot), nothing is shown on screen.
+# A summary of the run (timings of each stage) is written to stats.json in the same folder.
+# With --index, the standardized features are also saved as a similarity index (see similarity_index.py).
 ###########################
 
 # Python library imports
 import os
-import numpy as np 
-import pandas as pd 
-from matplotlib import pyplot as plt 
-from sklearn.cluster import AgglomerativeClustering, KMeans, DBSCAN
+import argparse
+import numpy as np
+import pandas as pd
+from sklearn.cluster import AgglomerativeClustering, KMeans, MiniBatchKMeans, DBSCAN, Birch
 from sklearn.preprocessing import StandardScaler
-import seaborn as sns
+import config
+import feature_io
+import cluster_report
+import similarity_index
+import instrumentation
+from instrumentation import log, stats
 
 
 # File-specific configurations
 FEATURE_WEIGHTS = {
-    
-}
-
-# take file and cluster
-df = pd.read_csv("extracted_data.csv")
-
-# drop map_id
-df = df.drop(columns=["map_id"])
-
-# drop all rows where overall difficulty < 5
-df = df[df["overall_difficulty"] > 5]
-
-df = df.drop(columns=["overall_difficulty"])
-#df = df.drop(columns=["max_stream_length"])
-
-print(f'Clustering based on {len(df.columns)} features')
-print(f'Features: {df.columns}')
-
-# normalize the data
-df_scaled = df.copy()
-scaler = StandardScaler()
-df_scaled = scaler.fit_transform(df_scaled)
 
-# print number of rows and columns
-print(f"Rows: {df_scaled.shape[0]}")
-
-# cluster the data
-kmeans = DBSCAN(eps=0.5, min_samples=5)
-kmeans_clusters = kmeans.fit_predict(df_scaled)
-
-
-# only keep certain features for pair plot
-#df = df[['jump_density', 'burst_density', 'stream_density']]
-
-# add the clusters to the dataframe
-df["kmeans_cluster"] = kmeans_clusters
-
-# drop all rows where kmeans_cluster = -1
-df = df[df["kmeans_cluster"] != -1]
-
-# pair plot
-sns.pairplot(df, hue="kmeans_cluster")
-plt.show()
+}
 
-# get number of points in each cluster
-print(df["kmeans_cluster"].value_counts())
+ALGORITHMS = ["dbscan", "kmeans", "minibatch-kmeans", "agglomerative", "birch"]
+INCREMENTAL_ALGORITHMS = ["minibatch-kmeans", "birch"] # the ones that can learn chunk by chunk (partial_fit)
+
+
+# Function to load the features to cluster on
+# returns the map ids and the feature dataframe (without map_id and overall_difficulty)
+def load_features(path, min_difficulty = 5):
+    # take file and cluster (csv, parquet, feather or npz, picked from the extension)
+    return prepare_features(feature_io.read_features(path), min_difficulty)
+
+
+# Function to keep the rows and columns to cluster on (works on the whole table or on a chunk)
+def prepare_features(df, min_difficulty = 5):
+    # drop all rows where overall difficulty < min_difficulty
+    df = df[df["overall_difficulty"] > min_difficulty]
+
+    map_ids = df["map_id"].to_numpy()
+
+    # drop map_id and overall difficulty
+    df = df.drop(columns=["map_id", "overall_difficulty"])
+    #df = df.drop(columns=["max_stream_length"])
+
+    return map_ids, df
+
+
+# Function to build the clustering model picked on the command line
+def make_model(args):
+    if args.algorithm == "dbscan":
+        # the neighbor index (ball tree / kd tree) keeps neighborhood queries away from O(n^2)
+        return DBSCAN(eps=args.eps, min_samples=args.min_samples, algorithm=args.neighbors,
+                      leaf_size=args.leaf_size, n_jobs=args.n_jobs)
+    if args.algorithm == "kmeans":
+        return KMeans(n_clusters=args.clusters, n_init="auto", random_state=args.seed)
+    if args.algorithm == "minibatch-kmeans":
+        return MiniBatchKMeans(n_clusters=args.clusters, batch_size=args.batch_size, n_init="auto", random_state=args.seed)
+    if args.algorithm == "agglomerative":
+        return AgglomerativeClustering(n_clusters=args.clusters)
+    if args.algorithm == "birch":
+        return Birch(n_clusters=args.clusters, threshold=args.birch_threshold)
+    raise ValueError(f"Unknown clustering algorithm '{args.algorithm}'")
+
+
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(description="Cluster extracted osu! map features.")
+    parser.add_argument("--input", default=config.extraction_file, help="feature file (csv, parquet, feather or npz)")
+    parser.add_argument("--algorithm", choices=ALGORITHMS, default="dbscan")
+    parser.add_argument("--min-difficulty", type=float, default=5, help="only cluster maps with a higher overall difficulty")
+
+    parser.add_argument("--eps", type=float, default=0.5, help="dbscan: neighborhood radius")
+    parser.add_argument("--min-samples", type=int, default=5, help="dbscan: points needed to form a core point")
+    parser.add_argument("--neighbors", choices=["auto", "ball_tree", "kd_tree", "brute"], default="kd_tree",
+                        help="dbscan: neighbor index used for the neighborhood queries")
+    parser.add_argument("--leaf-size", type=int, default=40, help="dbscan: leaf size of the neighbor index")
+
+    parser.add_argument("--clusters", type=int, default=8, help="kmeans, minibatch-kmeans, agglomerative, birch: number of clusters")
+    parser.add_argument("--batch-size", type=int, default=4096, help="minibatch-kmeans: rows per mini-batch")
+    parser.add_argument("--birch-threshold", type=float, default=0.5, help="birch: radius of a subcluster")
+
+    parser.add_argument("--n-jobs", type=int, default=-1, help="parallel jobs for the neighbor queries (-1 = all cores)")
+    parser.add_argument("--seed", type=int, default=0)
+
+    parser.add_argument("--chunked", action="store_true", help="stream the feature file in chunks (minibatch-kmeans or birch only)")
+    parser.add_argument("--chunk-size", type=int, default=100000, help="chunked: rows read at a time")
+    parser.add_argument("--epochs", type=int, default=1, help="chunked: passes over the file when fitting the model")
+    parser.add_argument("--labels", default=None, help="csv file to write the cluster of every map to")
+    parser.add_argument("--index", default=None, help="also save a similarity index of the standardized features to this file (not with --chunked)")
+
+    parser.add_argument("--report-dir", default=None, help="folder to write the cluster report to (default: <input>_report)")
+    parser.add_argument("--no-plot", action="store_true", help="only write the cluster summary, skip the pair plot")
+    parser.add_argument("--plot-points", type=int, default=cluster_report.PLOT_POINTS,
+                        help="most points drawn in the pair plot (sampled evenly from every cluster)")
+
+    parser.add_argument("--log-level", default=instrumentation.LOG_LEVEL, choices=["DEBUG", "INFO", "WARNING", "ERROR"], type=str.upper)
+    parser.add_argument("--profile", default=instrumentation.PROFILE_FILE, help="write cProfile stats of the run to this file")
+    parser.add_argument("--trace-memory", action="store_true", default=instrumentation.TRACE_MEMORY,
+                        help="record the peak Python memory of the run in stats.json")
+    return parser.parse_args(argv)
+
+
+# Function to write the cluster report and print where it went
+def write_report(args, report):
+    with stats.timer("stage.report"):
+        summary = report.write(args.report_dir, plot=not args.no_plot, extra={"algorithm": args.algorithm, "input": args.input})
+    log.info(f"Wrote cluster report to {args.report_dir}")
+
+    # get number of points in each cluster
+    log.info("Cluster sizes:\n" + summary.set_index("cluster")["size"].sort_values(ascending=False).to_string())
+
+
+# Function to cluster the feature file chunk by chunk
+# 1. fit the scaler incrementally, 2. fit the model incrementally, 3. label every chunk and write it out
+def cluster_chunked(args):
+    if args.algorithm not in INCREMENTAL_ALGORITHMS:
+        raise SystemExit(f"--chunked needs an incremental algorithm ({', '.join(INCREMENTAL_ALGORITHMS)}), not {args.algorithm}")
+    if args.index:
+        raise SystemExit("--index needs the whole feature table in memory, it can't be used with --chunked")
+
+    columns = []
+
+    def chunks():
+        for chunk in feature_io.iter_feature_chunks(args.input, args.chunk_size):
+            map_ids, df = prepare_features(chunk, args.min_difficulty)
+            columns[:] = df.columns
+            if len(df) > 0:
+                yield map_ids, df.to_numpy(dtype=np.float64)
+
+    # normalize the data (statistics are updated one chunk at a time)
+    scaler = StandardScaler()
+    rows = 0
+    with stats.timer("stage.scale"):
+        for map_ids, X in chunks():
+            scaler.partial_fit(X)
+            rows += len(X)
+    stats.count("rows", rows)
+    log.info(f"Rows: {rows}")
+    if rows == 0:
+        raise SystemExit(f"No maps to cluster in {args.input}")
+
+    # cluster the data
+    model = make_model(args)
+    with stats.timer("stage.fit"):
+        for epoch in range(args.epochs):
+            for map_ids, X in chunks():
+                model.partial_fit(scaler.transform(X))
+            log.debug(f"Finished epoch {epoch + 1}/{args.epochs}")
+
+    # label the maps and write them out as we go
+    labels_file = args.labels or os.path.splitext(args.input)[0] + "_clusters.csv"
+    report = None
+    with stats.timer("stage.predict"), open(labels_file, "w", encoding="utf-8", newline="") as f:
+        header = True
+        for map_ids, X in chunks():
+            clusters = model.predict(scaler.transform(X))
+            pd.DataFrame({"map_id": map_ids, "cluster": clusters}).to_csv(f, header=header, index=False)
+            header = False
+
+            # summary statistics and the plot sample are collected chunk by chunk as well
+            if report is None:
+                report = cluster_report.ClusterReport(columns, args.plot_points, args.seed)
+            report.add(X, clusters)
+
+    log.info(f"Wrote cluster labels to {labels_file}")
+    write_report(args, report)
+
+
+# Function to cluster the whole feature table at once
+def cluster_in_memory(args):
+    with stats.timer("stage.load"):
+        map_ids, df = load_features(args.input, args.min_difficulty)
+
+    log.info(f'Clustering based on {len(df.columns)} features')
+    log.info(f'Features: {list(df.columns)}')
+
+    # normalize the data
+    scaler = StandardScaler()
+    with stats.timer("stage.scale"):
+        df_scaled = scaler.fit_transform(df.to_numpy(dtype=np.float64))
+
+    # print number of rows and columns
+    stats.count("rows", df_scaled.shape[0])
+    log.info(f"Rows: {df_scaled.shape[0]}")
+
+    # keep the scaled features around as a similarity index
+    if args.index:
+        with stats.timer("stage.index"):
+            similarity_index.SimilarityIndex.from_scaled(map_ids, df.columns, scaler, df_scaled).save(args.index)
+        log.info(f"Wrote similarity index to {args.index}")
+
+    # cluster the data
+    model = make_model(args)
+    with stats.timer("stage.fit"):
+        clusters = model.fit_predict(df_scaled)
+
+    if args.labels:
+        pd.DataFrame({"map_id": map_ids, "cluster": clusters}).to_csv(args.labels, index=False)
+
+    # only keep certain features for pair plot
+    #df = df[['jump_density', 'burst_density', 'stream_density']]
+
+    # summary per cluster and a pair plot of a sample (noise points are left out of the plot)
+    report = cluster_report.ClusterReport(df.columns, args.plot_points, args.seed)
+    report.add(df.to_numpy(dtype=np.float64), clusters)
+    write_report(args, report)
+
+
+def main(argv = None):
+    args = parse_args(argv)
+    args.report_dir = args.report_dir or os.path.splitext(args.input)[0] + "_report"
+    os.makedirs(args.report_dir, exist_ok=True)
+
+    instrumentation.setup_logging(args.log_level)
+    with instrumentation.instrumented_run("cluster", os.path.join(args.report_dir, "stats.json"), args.profile, args.trace_memory):
+        if args.chunked:
+            cluster_chunked(args)
+        else:
+            cluster_in_memory(args)
+
+
+if __name__ == "__main__":
+    main()
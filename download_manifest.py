@@ -0,0 +1,113 @@
+###########################
+# This module keeps a manifest of every beatmapset the fetcher has attempted.
+# Each set is recorded with its outcome (accepted difficulties, rejection reasons, bytes and hash),
+# so skip checks and progress counts never have to look at the map folder, and a crashed run can resume.
+###########################
+
+# Python library imports
+import re
+import json
+import time
+import sqlite3
+import threading
+
+# Outcomes of a beatmapset
+ACCEPTED = "accepted" # at least one difficulty was kept
+REJECTED = "rejected" # every difficulty was filtered out
+FAILED = "failed" # download or archive error, tried again on the next run
+
+# Name of the files written by the fetcher (<map_id>_<n>.osu)
+MAP_FILE_PATTERN = re.compile(r"^(\d+)_(\d+)\.osu$")
+
+
+class Manifest:
+
+    def __init__(self, manifest_file, store = None):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(manifest_file, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS beatmapsets (
+            map_id TEXT PRIMARY KEY,
+            status TEXT,
+            accepted INTEGER,
+            rejections TEXT,
+            bytes INTEGER,
+            hash TEXT,
+            updated REAL,
+            threshold REAL
+        )""")
+
+        # manifests written before the threshold was recorded
+        if "threshold" not in [row[1] for row in self.db.execute("PRAGMA table_info(beatmapsets)")]:
+            self.db.execute("ALTER TABLE beatmapsets ADD COLUMN threshold REAL")
+        self.db.commit()
+
+        # keep the outcomes in memory so skip checks and counts are O(1)
+        self.status = {}
+        self.accepted = {}
+        self.thresholds = {} # difficulty threshold of the sets that had difficulties below it
+        for map_id, status, accepted, threshold in self.db.execute("SELECT map_id, status, accepted, threshold FROM beatmapsets"):
+            self.status[map_id] = status
+            self.accepted[map_id] = accepted
+            if threshold is not None:
+                self.thresholds[map_id] = threshold
+        self.accepted_total = sum(self.accepted.values())
+
+        # first run on an existing map store: import the maps that are already there
+        if len(self.status) == 0 and store is not None:
+            self.import_store(store)
+
+    # Function to record the maps of a store filled before the manifest existed
+    def import_store(self, store):
+        counts = {}
+        for name in store.iter_names():
+            match = MAP_FILE_PATTERN.match(name)
+            if match:
+                counts[match.group(1)] = counts.get(match.group(1), 0) + 1
+
+        for map_id, count in counts.items():
+            self.record(map_id, ACCEPTED, accepted=count, commit=False)
+        with self.lock:
+            self.db.commit()
+
+    # Function to check if a beatmapset was already handled (failed downloads are tried again)
+    # sets that had difficulties below a higher threshold than difficulty_threshold are checked again
+    def is_done(self, map_id, difficulty_threshold = None):
+        if self.status.get(map_id) not in (ACCEPTED, REJECTED):
+            return False
+        threshold = self.thresholds.get(map_id)
+        return threshold is None or difficulty_threshold is None or difficulty_threshold >= threshold
+
+    # Number of difficulties accepted so far
+    def accepted_count(self):
+        return self.accepted_total
+
+    # Function to record the outcome of a beatmapset
+    # threshold is the difficulty threshold that rejected some of its difficulties (None if none were)
+    def record(self, map_id, status, accepted = 0, rejections = None, nbytes = None, content_hash = None, threshold = None, commit = True):
+        with self.lock:
+            self.db.execute("""INSERT OR REPLACE INTO beatmapsets (map_id, status, accepted, rejections, bytes, hash, updated, threshold)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", (
+                map_id, status, accepted, json.dumps(rejections or {}), nbytes, content_hash, time.time(), threshold))
+            if commit:
+                self.db.commit()
+
+            self.accepted_total += accepted - self.accepted.get(map_id, 0)
+            self.status[map_id] = status
+            self.accepted[map_id] = accepted
+            if threshold is not None:
+                self.thresholds[map_id] = threshold
+            else:
+                self.thresholds.pop(map_id, None)
+
+    # Function to count the beatmapsets by outcome
+    def summary(self):
+        counts = {}
+        for status in self.status.values():
+            counts[status] = counts.get(status, 0) + 1
+        return counts
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
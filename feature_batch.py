@@ -0,0 +1,161 @@
+###########################
+# This module holds many maps at once as concatenated arrays with an offsets index (CSR-style).
+# Map k owns hit objects hit_offsets[k]:hit_offsets[k + 1] and timing points tp_offsets[k]:tp_offsets[k + 1],
+# so spacing, beat length lookups and run detection run once for the whole batch instead of once per map,
+# and per-map results come out of segmented reductions (prefix sums, bincount, reduceat).
+###########################
+
+# Python library imports
+import numpy as np
+
+
+class MapBatch:
+    __slots__ = ("x", "y", "time", "hit_offsets", "tp_time", "tp_beat_length", "tp_offsets", "difficulty",
+                 "map_of_hit", "pair_start", "pair_offsets")
+
+    def __init__(self, beatmaps):
+        hit_counts = np.fromiter((len(bm) for bm in beatmaps), dtype=np.int64, count=len(beatmaps))
+        self.hit_offsets = np.concatenate(([0], np.cumsum(hit_counts)))
+        self.difficulty = [bm.difficulty for bm in beatmaps]
+
+        # hit objects
+        self.x = concatenate([bm.x for bm in beatmaps], np.int16)
+        self.y = concatenate([bm.y for bm in beatmaps], np.int16)
+        self.time = concatenate([bm.time for bm in beatmaps], np.int32)
+        self.map_of_hit = np.repeat(np.arange(len(beatmaps)), hit_counts)
+
+        # pairs of consecutive hit objects of the same map (the first hit object of each pair)
+        self.pair_start = np.flatnonzero(self.map_of_hit[:-1] == self.map_of_hit[1:])
+        self.pair_offsets = np.concatenate(([0], np.cumsum(np.maximum(hit_counts - 1, 0))))
+
+        # uninherited timing points, sorted by time inside each map (stable, like timing.TimingIndex)
+        tp_time = concatenate([bm.tp_time for bm in beatmaps], np.float64)
+        beat_length = concatenate([bm.beat_length for bm in beatmaps], np.float64)
+        tp_map = np.repeat(np.arange(len(beatmaps)), [len(bm.tp_time) for bm in beatmaps])
+
+        uninherited = beat_length > 0
+        tp_time, beat_length, tp_map = tp_time[uninherited], beat_length[uninherited], tp_map[uninherited]
+        order = np.lexsort((tp_time, tp_map))
+        self.tp_time = tp_time[order]
+        self.tp_beat_length = beat_length[order]
+        self.tp_offsets = np.concatenate(([0], np.cumsum(np.bincount(tp_map, minlength=len(beatmaps)))))
+
+    def __len__(self):
+        return len(self.hit_offsets) - 1
+
+    # Number of hit objects of each map
+    def hit_counts(self):
+        return np.diff(self.hit_offsets)
+
+    # Distance between each pair of consecutive hit objects, for every map
+    def spacing(self):
+        dx = np.diff(self.x.astype(np.float64))[self.pair_start]
+        dy = np.diff(self.y.astype(np.float64))[self.pair_start]
+        return np.hypot(dx, dy)
+
+    # Time between each pair of consecutive hit objects, for every map (in ms)
+    def time_diffs(self):
+        return np.diff(self.time)[self.pair_start]
+
+    # Beat length active at the start of each pair, for every map
+    def pair_beat_lengths(self):
+        return self.beat_lengths_at(self.time[self.pair_start].astype(np.float64), self.map_of_hit[self.pair_start])
+
+    # Beat length active at each hit object, for every map
+    def hit_beat_lengths(self):
+        return self.beat_lengths_at(self.time.astype(np.float64), self.map_of_hit)
+
+    # Beat length active at each time in the map it belongs to (same rules as TimingIndex.beat_length_at)
+    # every map's times are shifted into their own range, so a single binary search covers the whole batch
+    def beat_lengths_at(self, times, maps):
+        if len(self.tp_time) == 0:
+            return np.full(len(times), np.nan)
+
+        low = min(times.min(initial=0), self.tp_time.min())
+        span = max(times.max(initial=0), self.tp_time.max()) - low + 1
+        tp_map = np.repeat(np.arange(len(self)), np.diff(self.tp_offsets))
+        keys = tp_map * span + (self.tp_time - low)
+
+        idx = np.searchsorted(keys, maps * span + (times - low), side="right") - 1
+
+        # times before the first timing point of a map use that point, maps without timing points get NaN
+        first = self.tp_offsets[maps]
+        has_points = self.tp_offsets[maps + 1] > first
+        idx = np.clip(np.maximum(idx, first), 0, len(self.tp_time) - 1)
+        return np.where(has_points, self.tp_beat_length[idx], np.nan)
+
+    # Index of the first hit object at or after each time, searched in the map of the hit object with the same index
+    # (one time per hit object, times past the end of the map or NaN give the index just past its last hit object)
+    def hit_search(self, times):
+        if len(self.time) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        finite = times[np.isfinite(times)]
+        low = min(float(self.time.min()), finite.min(initial=np.inf))
+        span = max(float(self.time.max()), finite.max(initial=-np.inf)) - low + 1
+        keys = self.map_of_hit * span + (self.time - low)
+
+        idx = np.searchsorted(keys, self.map_of_hit * span + (times - low), side="left")
+        return np.minimum(idx, self.hit_offsets[self.map_of_hit + 1])
+
+    # Mask of the last pair of every map
+    def last_pairs(self):
+        mask = np.zeros(self.pair_offsets[-1], dtype=bool)
+        ends = self.pair_offsets[1:]
+        mask[ends[ends > self.pair_offsets[:-1]] - 1] = True
+        return mask
+
+
+# Function to concatenate arrays (works for an empty list too)
+def concatenate(arrays, dtype):
+    if len(arrays) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.concatenate(arrays).astype(dtype, copy=False)
+
+
+# Function to find every run of True values in a mask split into segments (runs never cross a segment boundary)
+# returns the start, the length and the segment of each run
+def segment_runs(mask, offsets):
+    mask = np.asarray(mask, dtype=bool)
+    n = len(mask)
+
+    is_first = np.zeros(n, dtype=bool)
+    is_first[offsets[:-1][offsets[:-1] < n]] = True
+    is_last = np.zeros(n, dtype=bool)
+    ends = offsets[1:][offsets[1:] > offsets[:-1]]
+    is_last[ends - 1] = True
+
+    previous = np.concatenate(([False], mask[:-1])) & ~is_first
+    following = np.concatenate((mask[1:], [False])) & ~is_last
+    starts = np.flatnonzero(mask & ~previous)
+    stops = np.flatnonzero(mask & ~following) + 1
+
+    segments = np.searchsorted(offsets, starts, side="right") - 1
+    return starts, stops - starts, segments
+
+
+# Function to keep the runs that are closed by a non-matching pair (a run going on until the end of its segment is dropped)
+def closed_segment_runs(mask, offsets):
+    starts, lengths, segments = segment_runs(mask, offsets)
+    closed = starts + lengths < offsets[segments + 1]
+    return starts[closed], lengths[closed], segments[closed]
+
+
+# Function to sum values over each segment (prefix sums, empty segments give 0)
+def segment_sum(values, offsets):
+    totals = np.concatenate(([0], np.cumsum(values)))
+    return totals[offsets[1:]] - totals[offsets[:-1]]
+
+
+# Function to count, sum and take the maximum of run lengths per segment
+def run_stats(lengths, segments, n_segments):
+    count = np.bincount(segments, minlength=n_segments)
+    total = np.bincount(segments, weights=lengths, minlength=n_segments).astype(np.int64)
+
+    longest = np.zeros(n_segments, dtype=np.int64)
+    if len(lengths) > 0:
+        # runs come out in segment order, so every segment with runs is a contiguous block
+        firsts = np.flatnonzero(np.concatenate(([True], segments[1:] != segments[:-1])))
+        longest[segments[firsts]] = np.maximum.reduceat(lengths, firsts)
+
+    return count, total, longest
@@ -0,0 +1,110 @@
+###########################
+# This module keeps a persistent cache of extracted features so re-runs only process new or changed maps.
+# Entries are keyed by the map's key in its store (the file path for folders) and the version of the
+# feature code that produced them, and checked against size, a stamp (mtime, or pack offset for packed stores)
+# and a content hash. Several versions live side by side, so switching feature sets back and forth stays cached.
+###########################
+
+# Python library imports
+import json
+import time
+import sqlite3
+import hashlib
+
+# File-specific configurations
+COMMIT_EVERY = 500 # new entries written to disk at a time (a crash only loses the entries since the last commit)
+KEEP_VERSIONS = 4 # feature code versions kept in the cache (the least recently used ones are pruned)
+
+# Bumped when the layout of the cache tables changes (older caches are dropped)
+SCHEMA_VERSION = 2
+
+
+# Function to hash the contents of a map
+def content_hash(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class FeatureCache:
+
+    def __init__(self, cache_file, version, commit_every = COMMIT_EVERY, keep_versions = KEEP_VERSIONS):
+        self.version = version
+        self.commit_every = commit_every
+        self.keep_versions = keep_versions
+        self.pending = 0 # entries put since the last commit
+        self.db = sqlite3.connect(cache_file)
+
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self.db.execute("DROP TABLE IF EXISTS features")
+            self.db.execute("DROP TABLE IF EXISTS versions")
+            self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS features (
+            path TEXT,
+            version TEXT,
+            size INTEGER,
+            mtime_ns INTEGER,
+            hash TEXT,
+            features TEXT,
+            error TEXT,
+            PRIMARY KEY (path, version)
+        )""")
+        self.db.execute("CREATE TABLE IF NOT EXISTS versions (version TEXT PRIMARY KEY, last_used REAL)")
+
+        # remember when this version was last used, prune() drops the versions nobody used for a while
+        self.db.execute("INSERT OR REPLACE INTO versions VALUES (?, ?)", (version, time.time()))
+        self.db.commit()
+
+    # Function to get the cached (features, error) of a map, or None if it has to be extracted again
+    # fingerprint is the (size, stamp) of the map and load() returns its contents
+    def lookup(self, key, fingerprint, load):
+        row = self.db.execute("SELECT size, mtime_ns, hash, features, error FROM features WHERE path = ? AND version = ?",
+                              (key, self.version)).fetchone()
+        if row is None:
+            return None
+
+        size, stamp, cached_hash, features, error = row
+
+        # the map was rewritten, only trust the entry if the contents are still the same
+        if fingerprint != (size, stamp):
+            if fingerprint[0] != size or cached_hash is None or content_hash(load()) != cached_hash:
+                return None
+            self.db.execute("UPDATE features SET mtime_ns = ? WHERE path = ? AND version = ?", (fingerprint[1], key, self.version))
+
+        return (json.loads(features) if features is not None else None), error
+
+    # Function to store the (features, error) of a map
+    # digest is the content_hash of the map, computed by whoever read it for extraction (None if it could not be read)
+    def put(self, key, fingerprint, digest, features, error = None):
+        self.db.execute("INSERT OR REPLACE INTO features VALUES (?, ?, ?, ?, ?, ?, ?)", (
+            key,
+            self.version,
+            fingerprint[0],
+            fingerprint[1],
+            digest,
+            json.dumps(features) if features is not None else None,
+            error,
+        ))
+
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.commit()
+
+    def commit(self):
+        self.db.commit()
+        self.pending = 0
+
+    # Function to drop the entries of maps whose key is not in keys anymore (for every version),
+    # and every entry of the versions beyond the keep_versions most recently used ones
+    # returns the number of entries dropped
+    def prune(self, keys):
+        keep = set(keys)
+        stale = [(path,) for (path,) in self.db.execute("SELECT DISTINCT path FROM features") if path not in keep]
+        dropped = self.db.executemany("DELETE FROM features WHERE path = ?", stale).rowcount
+
+        old = self.db.execute("SELECT version FROM versions ORDER BY last_used DESC LIMIT -1 OFFSET ?", (self.keep_versions,)).fetchall()
+        dropped += self.db.executemany("DELETE FROM features WHERE version = ?", old).rowcount
+        self.db.executemany("DELETE FROM versions WHERE version = ?", old)
+        return dropped
+
+    def close(self):
+        self.commit()
+        self.db.close()
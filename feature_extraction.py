@@ -1,260 +1,893 @@
 ###########################
 # This script will take osu! maps and extract features from them.
 # The directories to each section can be edited in the config file. 
+# Features are registered with the intermediates they need (see feature_registry.py),
+# so a run only parses and computes what its feature set uses.
+# Folders are extracted in batches: the maps of a batch are computed together as concatenated arrays (see feature_batch.py).
 ###########################
 
 # Python library imports
 import os
 import sys
 import random
-import datetime
+import json
+import hashlib
+import inspect
+import functools
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
 import config
+import osu_parser
+import beatmap
+import patterns
+import timing
+import feature_cache
+import feature_registry
+import feature_batch
+import feature_io
+import map_store
+import instrumentation
+from instrumentation import log, stats
 
 # File-specific configurations
 JUMP_DISTANCE_THRESHOLD = 120 # 120 units
 JUMP_BEAT_THRESHOLD = 1 # 1 beats
+JUMP_MIN_RUN = 4 # shortest run of jumps that counts
+JUMP_LARGE_RUN = 12 # runs this long count as large
 
 STREAM_BEAT_THRESHOLD = 1/4 # 16th notes
+STREAM_MIN_RUN = 3 # shortest run of stream notes that counts
+STREAM_LARGE_RUN = 19 # runs this long count as large
+
+# Legacy feature set (jump/burst/stream counts)
+SMALL_JUMP_RUN = 3 # jump runs shorter than this are small
+MEDIUM_JUMP_RUN = 6 # jump runs shorter than this are medium, longer ones are large
+BURST_DISTANCE_THRESHOLD = 60 # notes closer than this (and less than a beat apart) are bursts
+BURST_MIN_RUN = 3 # shortest run of burst notes that counts
+STREAM_RUN = 9 # burst runs at least this long are streams
 
 SPEED_THRESHOLD = 185 #time in ms
 
-FEATURES = [
+# Windowed features
+WINDOW_BEATS = 4 # length of the sliding window, in beats of the timing point active where it starts
+STRAIN_SECTIONS = 4 # parts of the map (by time) the strain profile is split into
 
-    #"average_notes_per_second", #average notes per second
+EXTRACTION_WORKERS = os.cpu_count() # number of worker processes (1 = no pool)
+EXTRACTION_CHUNKSIZE = 64 # maps handed to a worker at a time
+EXTRACTION_BATCH_SIZE = 256 # maps computed together as one batch of concatenated arrays (1 = one map at a time)
+USE_FEATURE_CACHE = True # only extract new or changed maps (cache is stored next to the extraction file)
 
-    "jump_confidence", #confidence in jumps
-    "stream_confidence", #confidence in streams
+FEATURE_SETS = {
+    "current": [
 
+        #"average_notes_per_second", #average notes per second
 
-    "overall_difficulty" #overall difficulty of the map
-]
+        "jump_confidence", #confidence in jumps
+        "stream_confidence", #confidence in streams
 
-# Function to print with timestamp
-def tsprint(s):
-    print("[" + datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S") + "] " + s)
 
+        "overall_difficulty" #overall difficulty of the map
+    ],
 
+    "legacy": [
+        "jump_count",
+        "small_jumps_instances",
+        "medium_jumps_instances",
+        "large_jumps_instances",
+        "total_jump_instances",
+        "jump_density",
 
-def extract_features_from_folder(maps_path):
-    # Get all the maps
-    tsprint("Extracting features from maps...")
-    maps = os.listdir(maps_path)
+        "burst_count",
+        "burst_instances",
+        "burst_density",
 
-    # Generate pandas dataframe
-    df = pd.DataFrame(columns = ["map_id"] + FEATURES)
+        "stream_count",
+        "stream_instances",
+        "stream_density",
 
-    # Loop through the maps
-    for m in maps:
-        # Get the map path
-        map_file = os.path.join(maps_path, m)
-        features = extract_features(map_file)
+        "fast_density",
+
+        "hp_drain",
+        "circle_size",
+        "overall_difficulty",
+        "approach_rate",
+        "slider_multiplier",
+        "slider_tick_rate"
+    ],
+
+    "windowed": [
+        "peak_nps", #most notes per second in a window
+        "peak_jump_density", #highest share of jumps in a window
+    ] + [f"strain_section_{n + 1}" for n in range(STRAIN_SECTIONS)], #average notes per second in each part of the map
+}
+
+FEATURE_SET_NAMES = ["current"] # e.g. ["current", "windowed"] or ["current", "legacy"] to extract several sets from one parse
+
+
+# Function to get the features of one or more feature sets (shared features are only listed once)
+def feature_set(*names):
+    features = []
+    for name in names:
+        if name not in FEATURE_SETS:
+            raise ValueError(f"Unknown feature set '{name}' (expected one of {sorted(FEATURE_SETS)})")
+        features += [f for f in FEATURE_SETS[name] if f not in features]
+    return features
 
-        # Add the map and its features to the dataframe
-        df.loc[len(df)] = [m] + [features[f] for f in FEATURES]
-    
-    # Save the dataframe to a csv file
-    df.to_csv(config.extraction_file, index=False)
-
-def extract_features(map_file):
-    flag = False
-    with open(map_file, "r", encoding="utf-8") as f:
-        lines = f.readlines()
-
-    # Get the bpms (and their switches)
-    timing_points = []
-    for line in lines:
-        if line.startswith("[TimingPoints]"):
-            flag = True
-            continue
-        
-        if(flag):
-            if line.startswith("[") or line == "\n" or line == " \n":
-                flag = False
-                break
-            timing_point = {}
-            timing_point["time"] = float(line.split(",")[0])
-            timing_point["beat_length"] = float(line.split(",")[1])
-            timing_point["meter"] = int(line.split(",")[2])
-
-            timing_points.append(timing_point)
-    
-    # Get difficulty stats
-    diff = {}
-    for line in lines:
-        if line.startswith("[Difficulty]"):
-            flag = True
-            continue
 
-        if(flag):
-            if line.startswith("[") or line == "\n" or line == " \n":
-                flag = False
-                break
-            diff[line.split(":")[0]] = line.split(":")[1].strip()
-
-        
-    # Get the hit objects
-    hit_objects = []
-    for line in lines:
-        if line.startswith("[HitObjects]"):
-            flag = True
+FEATURES = feature_set(*FEATURE_SET_NAMES)
+
+
+# Function to extract features without letting one broken map stop the whole run
+# returns (features, None) on success and (None, error message) on failure
+def extract_features_safe(map_file, features = None):
+    try:
+        return extract_features(map_file, features), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+# Function to read a map once, for both extraction and the feature cache
+# returns the raw bytes of the map and their content hash (a map that can't be read is handed on as it is,
+# so extraction reports the error, and the hash is None)
+def read_hashed(map_file):
+    try:
+        data = map_store.load(map_file)
+    except OSError:
+        return map_file, None
+    return data, feature_cache.content_hash(data)
+
+
+# Function to extract features from a map and hash it from the same read
+# returns (features, error, content hash)
+def extract_features_hashed(map_file, features = None):
+    data, digest = read_hashed(map_file)
+    return (*extract_features_safe(data, features), digest)
+
+
+# Function to extract features from a batch of maps and hash them from the same reads, like extract_features_hashed
+def extract_features_batch_hashed(map_files, features = None):
+    data, digests = zip(*map(read_hashed, map_files))
+    return [(*result, digest) for result, digest in zip(extract_features_batch(list(data), features), digests)]
+
+
+# Function run in the worker processes: extracts a map and hands back what the worker recorded
+def extract_features_worker(map_file, features = None, hashed = False):
+    extract = extract_features_hashed if hashed else extract_features_safe
+    return extract(map_file, features), stats.take()
+
+
+# Function run in the worker processes: extracts a batch of maps and hands back what the worker recorded
+def extract_features_batch_worker(map_files, features = None, hashed = False):
+    extract = extract_features_batch_hashed if hashed else extract_features_batch
+    return extract(map_files, features), stats.take()
+
+
+# Function to split an iterable into lists of batch_size items
+def iter_batches(items, batch_size):
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+# Function to extract features from many maps, in the same order as map_files (paths or packed map references)
+# workers > 1 spreads the maps over a process pool, handing them out in chunks to keep IPC low
+# batch_size > 1 computes the maps batch by batch (see extract_features_batch), each batch is one task for the pool
+# hashed adds the content hash of every map to its result (features, error, hash), for the feature cache
+def iter_features(map_files, workers = EXTRACTION_WORKERS, chunksize = EXTRACTION_CHUNKSIZE, features = None, batch_size = EXTRACTION_BATCH_SIZE, hashed = False):
+    if batch_size is not None and batch_size > 1:
+        batches = iter_batches(map_files, batch_size)
+        if workers is not None and workers <= 1:
+            extract = extract_features_batch_hashed if hashed else extract_features_batch
+            for batch in batches:
+                yield from extract(batch, features)
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            worker = functools.partial(extract_features_batch_worker, features=features, hashed=hashed)
+            for results, taken in executor.map(worker, batches):
+                stats.merge(taken)
+                yield from results
+        return
+
+    if workers is not None and workers <= 1:
+        extract = extract_features_hashed if hashed else extract_features_safe
+        yield from map(functools.partial(extract, features=features), map_files)
+        return
+
+    # timings recorded in the workers are merged into the stats of this process
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        worker = functools.partial(extract_features_worker, features=features, hashed=hashed)
+        for result, taken in executor.map(worker, map_files, chunksize=chunksize):
+            stats.merge(taken)
+            yield result
+
+
+# Function to get a stamp of the feature code and thresholds
+# cached features computed with a different stamp are thrown away
+def feature_version(features = None):
+    features = features or FEATURES
+    h = hashlib.sha1()
+    h.update(json.dumps({
+        "JUMP_DISTANCE_THRESHOLD": JUMP_DISTANCE_THRESHOLD,
+        "JUMP_BEAT_THRESHOLD": JUMP_BEAT_THRESHOLD,
+        "JUMP_MIN_RUN": JUMP_MIN_RUN,
+        "JUMP_LARGE_RUN": JUMP_LARGE_RUN,
+        "STREAM_BEAT_THRESHOLD": STREAM_BEAT_THRESHOLD,
+        "STREAM_MIN_RUN": STREAM_MIN_RUN,
+        "STREAM_LARGE_RUN": STREAM_LARGE_RUN,
+        "SMALL_JUMP_RUN": SMALL_JUMP_RUN,
+        "MEDIUM_JUMP_RUN": MEDIUM_JUMP_RUN,
+        "BURST_DISTANCE_THRESHOLD": BURST_DISTANCE_THRESHOLD,
+        "BURST_MIN_RUN": BURST_MIN_RUN,
+        "STREAM_RUN": STREAM_RUN,
+        "SPEED_THRESHOLD": SPEED_THRESHOLD,
+        "WINDOW_BEATS": WINDOW_BEATS,
+        "STRAIN_SECTIONS": STRAIN_SECTIONS,
+        "FEATURES": list(features),
+    }, sort_keys=True).encode())
+
+    # the code that computes the features (only the intermediates and features of this set)
+    h.update(registry.source(features).encode())
+    h.update(batch_registry.source([f for f in features if f in batch_registry.features], ["batch"]).encode())
+    for helper in [difficulty_stat, window_end_times, section_means]:
+        h.update(inspect.getsource(helper).encode())
+    for module in [osu_parser, beatmap, patterns, timing, feature_registry, feature_batch]:
+        with open(module.__file__, "rb") as f:
+            h.update(f.read())
+
+    return h.hexdigest()
+
+
+def extract_features_from_folder(maps_path, workers = EXTRACTION_WORKERS, chunksize = EXTRACTION_CHUNKSIZE, output_file = None, use_cache = USE_FEATURE_CACHE, features = None, batch_size = EXTRACTION_BATCH_SIZE):
+    if output_file is None:
+        output_file = config.extraction_file
+    features = list(features or FEATURES)
+    registry.plan(features) # fail early on unknown features
+
+    # Get all the maps (sorted so the output is reproducible)
+    log.info("Extracting features from maps...")
+    store = map_store.open_store(maps_path)
+    maps = sorted(store.iter_names())
+
+    # Reuse the features of maps that did not change since the last run
+    results = [None] * len(maps)
+    cache = None
+    if use_cache:
+        cache = feature_cache.FeatureCache(os.path.splitext(output_file)[0] + "_cache.sqlite", feature_version(features))
+        for i, m in enumerate(maps):
+            results[i] = cache.lookup(store.key(m), store.fingerprint(m), lambda: store.read(m))
+
+    todo = [i for i in range(len(maps)) if results[i] is None]
+    stats.count("maps.cached", len(maps) - len(todo))
+    log.info(f"{len(maps) - len(todo)} maps cached, extracting {len(todo)} maps...")
+
+    # go through the maps in storage order (pack file and offset for packed stores) so reads stay sequential
+    todo.sort(key=lambda i: store.source(maps[i]))
+    sources = (store.source(maps[i]) for i in todo)
+    # the cache commits every few hundred maps, and whatever is left when the run stops (even on Ctrl+C)
+    progress = instrumentation.Progress("Maps extracted", len(todo))
+    try:
+        # with the cache on, the workers hash each map from the bytes they extract it from
+        for i, result in zip(todo, iter_features(sources, workers, chunksize, features, batch_size, hashed=cache is not None)):
+            if cache is not None:
+                values, error, digest = result
+                cache.put(store.key(maps[i]), store.fingerprint(maps[i]), digest, values, error)
+                result = values, error
+            results[i] = result
+            stats.count("maps.extracted" if result[1] is None else "maps.failed")
+            progress.update()
+    finally:
+        if cache is not None:
+            cache.commit()
+    progress.finish()
+
+    if cache is not None:
+        dropped = cache.prune(store.key(m) for m in maps)
+        if dropped > 0:
+            log.info(f"Dropped {dropped} cached entries of removed maps or old feature definitions")
+        cache.close()
+
+    # Collect the features column by column, the dataframe is only built once at the end
+    columns = {name: [] for name in ["map_id"] + features}
+    errors = []
+
+    # Loop through the maps
+    for m, (values, error) in zip(maps, results):
+        if error is not None:
+            errors.append([m, error])
             continue
 
-        if(flag):
-            if line.startswith("[") or line == "\n" or line == " \n":
-                flag = False
-                break
-            hit_object = {}
-            hit_object["x"] = int(line.split(",")[0])
-            hit_object["y"] = int(line.split(",")[1])
-            hit_object["time"] = int(line.split(",")[2])
-            hit_object["type"] = int(line.split(",")[3])
-            hit_object["is_hitcircle"] = hit_object["type"] & 1
-            hit_object["is_slider"] = hit_object["type"] & 2
-            hit_object["is_spinner"] = hit_object["type"] & 8
-
-            hit_objects.append(hit_object)
-        
-    #tsprint(f"Map {map_file.split("/")[1]} has {len(timing_points)} timing points and {len(hit_objects)} hit objects. Starting feature extraction...")
-
-
-    ##############################
-    # Features extraction setup
-    ##############################
-
-    features = {}
-
-    # Overall features
-   
-    #features["hp_drain"] = float(diff["HPDrainRate"]) if "HPDrainRate" in diff else -1
-    #features["circle_size"] = float(diff["CircleSize"]) if "CircleSize" in diff else -1
-    features["overall_difficulty"] = float(diff["OverallDifficulty"]) if "OverallDifficulty" in diff else -1
-    #features["approach_rate"] = float(diff["ApproachRate"]) if "ApproachRate" in diff else -1
-    #features["slider_multiplier"] = float(diff["SliderMultiplier"]) if "SliderMultiplier" in diff else -1
-    #features["slider_tick_rate"] = float(diff["SliderTickRate"]) if "SliderTickRate" in diff else -1
-
-
-    # Feature extraction
-    hit_times = [h["time"] for h in hit_objects]
-    hit_distances = [((hit_objects[i]["x"] - hit_objects[i+1]["x"])**2 + (hit_objects[i]["y"] - hit_objects[i+1]["y"])**2)**0.5 for i in range(len(hit_objects)-1)]
-
-    # Get timing points to calculate beat length at each hit object
-    hit_beat_lengths = []
-    found = False
-    for h in hit_objects[::-1]: #don't include the very last note.
-        for t in timing_points:
-            if t["time"] > h["time"] and t["beat_length"] > 0:
-                found = True
-                hit_beat_lengths.append(t["beat_length"])
-                break
-
-        # If no timing point is found, use the last timing point
-        if(not found):
-            # If no timing point is found, use the last non-negative timing point
-            for t in timing_points[::-1]:
-                if t["beat_length"] > 0:
-                    hit_beat_lengths.append(t["beat_length"])
-                    break
+        columns["map_id"].append(m)
+        for f in features:
+            columns[f].append(values[f])
     
-    # Get the beat length at each hit object
-    hit_beat_lengths = [hit_beat_lengths[i] for i in range(len(hit_beat_lengths)-1)]
-
-    ##############################
-    # Feature extraction
-    ##############################
-
-    time_diffs = [hit_times[i+1] - hit_times[i] for i in range(len(hit_times)-1)]
-
-    # Jump features
-    jumps = 0
-    jumps_total = 0
-    small_jumps = 0
-    medium_jumps = 0
-    large_jumps = 0
-
-    jump_lengths = []
-
-    for i in range(len(hit_distances)):
-        if hit_distances[i] > JUMP_DISTANCE_THRESHOLD and time_diffs[i] < JUMP_BEAT_THRESHOLD * hit_beat_lengths[i]:
-            jumps += 1
-        else: 
-            if jumps >= 12:
-                large_jumps += 1
-            elif jumps >= 8:
-                medium_jumps += 1
-            elif jumps >= 4:
-                small_jumps += 1
-            
-            
-            if jumps >= 4: 
-                jumps_total += jumps
-                jump_lengths.append(jumps)
-        
-            jumps = 0
-
-    jump_density = jumps_total / len(hit_objects)
-    total_jumps = small_jumps + medium_jumps + large_jumps
-    large_jumps_density = large_jumps / total_jumps if total_jumps > 0 else 0
-    average_jump_length = sum(jump_lengths) / len(jump_lengths) if len(jump_lengths) > 0 else 0
-    max_jump_length = max(jump_lengths) if len(jump_lengths) > 0 else 0
-
-    features["jump_confidence"] = min((jump_density * 0.3)
-    + (large_jumps_density * 0.4)
-    + (min(average_jump_length / 7.0, 1.0) * 0.3)
-    + (min(max_jump_length / 8.0, 1.0) * 0.3)
-    , 1.0)
-
-
-    # Stream features
-    streams = 0
-    streams_total = 0
-    mini_streams = 0
-    small_streams = 0
-    medium_streams = 0
-    large_streams = 0
-
-    stream_lengths = []
-
-    for i in range(len(hit_distances)):
-        if time_diffs[i] < STREAM_BEAT_THRESHOLD * hit_beat_lengths[i]:
-            streams += 1
-        else: 
-            if streams >= 19:
-                large_streams += 1
-            elif streams >= 13:
-                medium_streams += 1
-            elif streams >= 7:
-                small_streams += 1
-            elif streams >= 3:
-                mini_streams += 1
-            
-            if streams >= 3:
-                streams_total += streams 
-                stream_lengths.append(streams)
-        
-            streams = 0
-
-    stream_density = streams_total / len(hit_objects)
-    total_streams = small_streams + medium_streams + large_streams + mini_streams
-    large_streams_density = large_streams / (total_streams) if total_streams > 0 else 0
-    average_stream_length = sum(stream_lengths) / len(stream_lengths) if len(stream_lengths) > 0 else 0
-    max_stream_length = max(stream_lengths) if len(stream_lengths) > 0 else 0
-
-    features["stream_confidence"] = min((stream_density * 0.3)
-    + (large_streams_density * 0.4)
-    + (min(average_stream_length / 7.0, 1.0) * 0.3)
-    + (min(max_stream_length / 13.0, 1.0) * 0.3)
-    , 1.0)
+    # Save the dataframe (the format is picked from the extension of the output file)
+    df = pd.DataFrame(columns)
+    with stats.timer("write_time"):
+        feature_io.write_features(df, output_file)
+
+    # Save the maps that failed next to it (and remove the list of an earlier run if nothing failed this time)
+    errors_file = os.path.splitext(output_file)[0] + "_errors.csv"
+    if len(errors) > 0:
+        log.warning(f"Failed to extract features from {len(errors)} maps")
+        pd.DataFrame(errors, columns = ["map_id", "error"]).to_csv(errors_file, index=False)
+    elif os.path.exists(errors_file):
+        os.remove(errors_file)
+
+# Function to extract features from a map (a path or a map_store.PackedRef)
+# only the sections and intermediates the requested features need are parsed and computed
+def extract_features(map_file, features = None):
+    return registry.compute(map_store.resolve(map_file), features or FEATURES)
+
+
+# Function to compute features from values computed beforehand, like extract_features_safe
+def evaluate_safe(values, features):
+    try:
+        return registry.evaluate(values, features), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+# Function to extract features from many maps at once, gives the same features as extract_features for every map
+# the maps are parsed one by one, then every batched feature is computed over all of them as concatenated arrays
+# returns one (features, None) or (None, error message) per map, like extract_features_safe
+def extract_features_batch(map_files, features = None):
+    features = list(features or FEATURES)
+    plan = registry.plan(features)
+    results = [None] * len(map_files)
 
+    # parse every map into its arrays
+    loaded = []
+    for i, map_file in enumerate(map_files):
+        try:
+            with stats.timer("batch.parse_time"):
+                sections = osu_parser.parse_osu(map_store.resolve(map_file), plan.sections)
+                loaded.append((i, {"beatmap": beatmap.Beatmap.from_sections(sections), "difficulty": sections.get("Difficulty", {})}))
+        except Exception as e:
+            results[i] = (None, f"{type(e).__name__}: {e}")
 
+    # maps with fewer than two hit objects (and features without a batched version) go through the per-map code,
+    # so they fail or succeed exactly like extract_features
+    batched = [f for f in features if f in batch_registry.features]
+    unbatched = [f for f in features if f not in batch_registry.features]
+    in_batch = [(i, values) for i, values in loaded if len(values["beatmap"]) >= 2]
+    for i, values in loaded:
+        if len(values["beatmap"]) < 2:
+            results[i] = evaluate_safe(values, features)
 
-    return features
+    if in_batch:
+        try:
+            batch = feature_batch.MapBatch([values["beatmap"] for i, values in in_batch])
+            columns = {name: column.tolist() if isinstance(column, np.ndarray) else column
+                       for name, column in batch_registry.evaluate({"batch": batch}, batched).items()}
+        except Exception as e:
+            # a bad map fails the whole batch, compute the maps one by one so only that map gets an error
+            log.debug(f"Batch of {len(in_batch)} maps failed ({type(e).__name__}: {e}), extracting them one by one")
+            for i, values in in_batch:
+                results[i] = evaluate_safe(values, features)
+            return results
+
+        for k, (i, values) in enumerate(in_batch):
+            computed, error = evaluate_safe(values, unbatched) if unbatched else ({}, None)
+            if error is not None:
+                results[i] = (None, error)
+            else:
+                results[i] = ({name: columns[name][k] if name in columns else computed[name] for name in features}, None)
+
+    return results
+
+
+##############################
+# Intermediates
+##############################
+
+# Every feature is computed from these, each one is computed at most once per map
+registry = feature_registry.FeatureRegistry()
+
+
+@registry.intermediate("difficulty", sections=["Difficulty"])
+def difficulty(ctx):
+    return ctx[feature_registry.SECTIONS].get("Difficulty", {})
+
+
+@registry.intermediate("beatmap", sections=["TimingPoints", "HitObjects"])
+def beatmap_arrays(ctx):
+    return beatmap.Beatmap.from_sections(ctx[feature_registry.SECTIONS])
+
+
+# Distance between each pair of consecutive hit objects
+@registry.intermediate("spacing", needs=["beatmap"])
+def spacing(ctx):
+    return ctx["beatmap"].spacing()
+
+
+# Time between each pair of consecutive hit objects
+@registry.intermediate("time_diffs", needs=["beatmap"])
+def time_diffs(ctx):
+    return ctx["beatmap"].time_diffs()
+
+
+# Beat length active at the start of each pair of consecutive hit objects
+@registry.intermediate("beat_lengths", needs=["beatmap"])
+def beat_lengths(ctx):
+    bm = ctx["beatmap"]
+    return timing.TimingIndex.from_beatmap(bm).beat_length_at(bm.time[:-1])
+
+
+@registry.intermediate("jump_mask", needs=["spacing", "time_diffs", "beat_lengths"])
+def jump_mask(ctx):
+    return (ctx["spacing"] > JUMP_DISTANCE_THRESHOLD) & (ctx["time_diffs"] < JUMP_BEAT_THRESHOLD * ctx["beat_lengths"])
+
+
+@registry.intermediate("stream_mask", needs=["time_diffs", "beat_lengths"])
+def stream_mask(ctx):
+    return ctx["time_diffs"] < STREAM_BEAT_THRESHOLD * ctx["beat_lengths"]
+
+
+# like the original extractor, bursts are close notes less than a full beat apart
+@registry.intermediate("burst_mask", needs=["spacing", "time_diffs", "beat_lengths"])
+def burst_mask(ctx):
+    return (ctx["spacing"] < BURST_DISTANCE_THRESHOLD) & (ctx["time_diffs"] < JUMP_BEAT_THRESHOLD * ctx["beat_lengths"])
+
+
+# Lengths of the runs of jumps/bursts as the legacy feature set counts them
+# (the pair ending on the last hit object is never part of a run, a run still going before it is counted)
+@registry.intermediate("jump_runs", needs=["jump_mask"])
+def jump_runs(ctx):
+    return patterns.find_runs(ctx["jump_mask"][:-1])[1]
+
+
+@registry.intermediate("burst_runs", needs=["burst_mask"])
+def burst_runs(ctx):
+    return patterns.find_runs(ctx["burst_mask"][:-1])[1]
+
+
+# Burst runs long enough to be streams, and the rest of the burst runs that count
+@registry.intermediate("long_burst_runs", needs=["burst_runs"])
+def long_burst_runs(ctx):
+    return ctx["burst_runs"][ctx["burst_runs"] >= STREAM_RUN]
+
+
+@registry.intermediate("short_burst_runs", needs=["burst_runs"])
+def short_burst_runs(ctx):
+    runs = ctx["burst_runs"]
+    return runs[(runs >= BURST_MIN_RUN) & (runs < STREAM_RUN)]
+
+
+# Windows of WINDOW_BEATS beats, one starting at each hit object
+@registry.intermediate("hit_beat_lengths", needs=["beatmap"])
+def hit_beat_lengths(ctx):
+    bm = ctx["beatmap"]
+    return timing.TimingIndex.from_beatmap(bm).beat_length_at(bm.time)
+
+
+# Function to get the time each window ends at (rounded up: hit objects are on whole ms,
+# so searching for it gives the same hit object whether the map is searched alone or in a batch)
+def window_end_times(time, beat_lengths):
+    return np.ceil(time + WINDOW_BEATS * beat_lengths)
+
+
+# Index just past the last hit object of each window (the whole rest of the map if there are no timing points)
+@registry.intermediate("window_ends", needs=["beatmap", "hit_beat_lengths"])
+def window_ends(ctx):
+    time = ctx["beatmap"].time
+    return np.searchsorted(time, window_end_times(time, ctx["hit_beat_lengths"]), side="left")
+
+
+# Notes per second in each window (0 if the map has no timing points)
+@registry.intermediate("strain", needs=["window_ends", "hit_beat_lengths"])
+def strain(ctx):
+    ends = ctx["window_ends"]
+    seconds = WINDOW_BEATS * ctx["hit_beat_lengths"] / 1000
+    return np.divide(ends - np.arange(len(ends)), seconds, out=np.zeros(len(ends)), where=np.isfinite(seconds))
+
+
+# Jumps by the hit object they start from
+@registry.intermediate("hit_jumps", needs=["jump_mask"])
+def hit_jumps(ctx):
+    return np.concatenate((ctx["jump_mask"], [False]))
+
+
+# Share of the hit objects of each window that start a jump to another hit object of the window
+# (prefix sums, so every window costs the same however long it is)
+@registry.intermediate("window_jump_density", needs=["hit_jumps", "window_ends"])
+def window_jump_density(ctx):
+    ends = ctx["window_ends"]
+    starts = np.arange(len(ends))
+    jumps = np.concatenate(([0], np.cumsum(ctx["hit_jumps"])))
+    return (jumps[ends - 1] - jumps[starts]) / (ends - starts)
+
+
+# Function to average values by section (sections without values give 0)
+def section_means(values, sections, n_sections):
+    totals = np.bincount(sections, weights=values, minlength=n_sections)
+    counts = np.bincount(sections, minlength=n_sections)
+    return np.divide(totals, counts, out=np.zeros(n_sections), where=counts > 0)
+
+
+# Average strain of the windows starting in each of STRAIN_SECTIONS equal parts of the map
+@registry.intermediate("strain_sections", needs=["beatmap", "strain"])
+def strain_sections(ctx):
+    time = ctx["beatmap"].time.astype(np.int64)
+    if len(time) == 0:
+        return np.zeros(STRAIN_SECTIONS)
+    sections = (time - time.min()) * STRAIN_SECTIONS // (time.max() - time.min() + 1)
+    return section_means(ctx["strain"], sections, STRAIN_SECTIONS)
+
+
+##############################
+# Features
+##############################
+
+# Overall features
+def difficulty_stat(ctx, key):
+    diff = ctx["difficulty"]
+    return float(diff[key]) if key in diff else -1
+
+
+@registry.feature("hp_drain", needs=["difficulty"])
+def hp_drain(ctx):
+    return difficulty_stat(ctx, "HPDrainRate")
+
+
+@registry.feature("circle_size", needs=["difficulty"])
+def circle_size(ctx):
+    return difficulty_stat(ctx, "CircleSize")
+
+
+@registry.feature("overall_difficulty", needs=["difficulty"])
+def overall_difficulty(ctx):
+    return difficulty_stat(ctx, "OverallDifficulty")
+
+
+@registry.feature("approach_rate", needs=["difficulty"])
+def approach_rate(ctx):
+    return difficulty_stat(ctx, "ApproachRate")
+
+
+@registry.feature("slider_multiplier", needs=["difficulty"])
+def slider_multiplier(ctx):
+    return difficulty_stat(ctx, "SliderMultiplier")
+
+
+@registry.feature("slider_tick_rate", needs=["difficulty"])
+def slider_tick_rate(ctx):
+    return difficulty_stat(ctx, "SliderTickRate")
+
+
+# Jump features
+@registry.feature("jump_confidence", needs=["beatmap", "jump_mask"])
+def jump_confidence(ctx):
+    return patterns.pattern_confidence(patterns.closed_run_lengths(ctx["jump_mask"]), len(ctx["beatmap"]),
+        min_length = JUMP_MIN_RUN, large_length = JUMP_LARGE_RUN, max_length_scale = 8.0)
+
+
+# Stream features
+@registry.feature("stream_confidence", needs=["beatmap", "stream_mask"])
+def stream_confidence(ctx):
+    return patterns.pattern_confidence(patterns.closed_run_lengths(ctx["stream_mask"]), len(ctx["beatmap"]),
+        min_length = STREAM_MIN_RUN, large_length = STREAM_LARGE_RUN, max_length_scale = 13.0)
+
+
+# Legacy jump features
+@registry.feature("jump_count", needs=["jump_runs"])
+def jump_count(ctx):
+    return int(ctx["jump_runs"].sum())
+
+
+@registry.feature("small_jumps_instances", needs=["jump_runs"])
+def small_jumps_instances(ctx):
+    return int(np.count_nonzero(ctx["jump_runs"] < SMALL_JUMP_RUN))
+
+
+@registry.feature("medium_jumps_instances", needs=["jump_runs"])
+def medium_jumps_instances(ctx):
+    runs = ctx["jump_runs"]
+    return int(np.count_nonzero((runs >= SMALL_JUMP_RUN) & (runs < MEDIUM_JUMP_RUN)))
+
+
+@registry.feature("large_jumps_instances", needs=["jump_runs"])
+def large_jumps_instances(ctx):
+    return int(np.count_nonzero(ctx["jump_runs"] >= MEDIUM_JUMP_RUN))
+
+
+@registry.feature("total_jump_instances", needs=["jump_runs"])
+def total_jump_instances(ctx):
+    return len(ctx["jump_runs"])
+
+
+@registry.feature("jump_density", needs=["beatmap", "jump_runs"])
+def jump_density(ctx):
+    return int(ctx["jump_runs"].sum()) / len(ctx["beatmap"])
+
+
+# Legacy burst and stream features
+@registry.feature("burst_count", needs=["short_burst_runs"])
+def burst_count(ctx):
+    return int(ctx["short_burst_runs"].sum())
+
+
+@registry.feature("burst_instances", needs=["short_burst_runs"])
+def burst_instances(ctx):
+    return len(ctx["short_burst_runs"])
+
+
+@registry.feature("burst_density", needs=["beatmap", "short_burst_runs"])
+def burst_density(ctx):
+    return int(ctx["short_burst_runs"].sum()) / len(ctx["beatmap"])
+
+
+@registry.feature("stream_count", needs=["long_burst_runs"])
+def stream_count(ctx):
+    return int(ctx["long_burst_runs"].sum())
+
+
+@registry.feature("stream_instances", needs=["long_burst_runs"])
+def stream_instances(ctx):
+    return len(ctx["long_burst_runs"])
+
+
+@registry.feature("stream_density", needs=["beatmap", "long_burst_runs"])
+def stream_density(ctx):
+    return int(ctx["long_burst_runs"].sum()) / len(ctx["beatmap"])
+
+
+# Speed features
+@registry.feature("fast_density", needs=["beatmap", "time_diffs"])
+def fast_density(ctx):
+    return int(np.count_nonzero(ctx["time_diffs"] < SPEED_THRESHOLD)) / len(ctx["beatmap"])
+
+
+# Windowed features
+@registry.feature("peak_nps", needs=["strain"])
+def peak_nps(ctx):
+    return float(ctx["strain"].max(initial=0))
+
+
+@registry.feature("peak_jump_density", needs=["window_jump_density"])
+def peak_jump_density(ctx):
+    return float(ctx["window_jump_density"].max(initial=0))
+
+
+def strain_section(ctx, section):
+    return float(ctx["strain_sections"][section])
+
+
+for n in range(STRAIN_SECTIONS):
+    registry.feature(f"strain_section_{n + 1}", needs=["strain_sections"])(functools.partial(strain_section, section=n))
+
+
+##############################
+# Batched features
+##############################
+
+# The same features over a whole feature_batch.MapBatch, every feature gives one value per map
+# (the masks are the same functions as above, they only do element-wise work on the pair arrays)
+batch_registry = feature_registry.FeatureRegistry(prefix="batch.")
+
+
+@batch_registry.intermediate("n_hits", needs=["batch"])
+def batch_n_hits(ctx):
+    return ctx["batch"].hit_counts()
+
+
+@batch_registry.intermediate("spacing", needs=["batch"])
+def batch_spacing(ctx):
+    return ctx["batch"].spacing()
+
+
+@batch_registry.intermediate("time_diffs", needs=["batch"])
+def batch_time_diffs(ctx):
+    return ctx["batch"].time_diffs()
+
+
+@batch_registry.intermediate("beat_lengths", needs=["batch"])
+def batch_beat_lengths(ctx):
+    return ctx["batch"].pair_beat_lengths()
+
+
+batch_registry.intermediate("jump_mask", needs=["spacing", "time_diffs", "beat_lengths"])(jump_mask)
+batch_registry.intermediate("stream_mask", needs=["time_diffs", "beat_lengths"])(stream_mask)
+batch_registry.intermediate("burst_mask", needs=["spacing", "time_diffs", "beat_lengths"])(burst_mask)
+batch_registry.intermediate("strain", needs=["window_ends", "hit_beat_lengths"])(strain)
+batch_registry.intermediate("window_jump_density", needs=["hit_jumps", "window_ends"])(window_jump_density)
+
+
+@batch_registry.intermediate("hit_beat_lengths", needs=["batch"])
+def batch_hit_beat_lengths(ctx):
+    return ctx["batch"].hit_beat_lengths()
+
+
+# window ends never go past the last hit object of the map
+@batch_registry.intermediate("window_ends", needs=["batch", "hit_beat_lengths"])
+def batch_window_ends(ctx):
+    batch = ctx["batch"]
+    return batch.hit_search(window_end_times(batch.time, ctx["hit_beat_lengths"]))
+
+
+@batch_registry.intermediate("hit_jumps", needs=["batch", "jump_mask"])
+def batch_hit_jumps(ctx):
+    batch = ctx["batch"]
+    jumps = np.zeros(len(batch.time), dtype=bool)
+    jumps[batch.pair_start] = ctx["jump_mask"]
+    return jumps
+
+
+# one row of STRAIN_SECTIONS averages per map
+@batch_registry.intermediate("strain_sections", needs=["batch", "strain"])
+def batch_strain_sections(ctx):
+    batch = ctx["batch"]
+    time = batch.time.astype(np.int64)
+    first = np.minimum.reduceat(time, batch.hit_offsets[:-1])[batch.map_of_hit]
+    last = np.maximum.reduceat(time, batch.hit_offsets[:-1])[batch.map_of_hit]
+    sections = batch.map_of_hit * STRAIN_SECTIONS + (time - first) * STRAIN_SECTIONS // (last - first + 1)
+    return section_means(ctx["strain"], sections, len(batch) * STRAIN_SECTIONS).reshape(len(batch), STRAIN_SECTIONS)
+
+
+# Runs as (starts, lengths, map of each run)
+@batch_registry.intermediate("closed_jump_runs", needs=["batch", "jump_mask"])
+def batch_closed_jump_runs(ctx):
+    return feature_batch.closed_segment_runs(ctx["jump_mask"], ctx["batch"].pair_offsets)
+
+
+@batch_registry.intermediate("closed_stream_runs", needs=["batch", "stream_mask"])
+def batch_closed_stream_runs(ctx):
+    return feature_batch.closed_segment_runs(ctx["stream_mask"], ctx["batch"].pair_offsets)
+
+
+# legacy runs leave out the last pair of every map
+@batch_registry.intermediate("jump_runs", needs=["batch", "jump_mask"])
+def batch_jump_runs(ctx):
+    batch = ctx["batch"]
+    return feature_batch.segment_runs(ctx["jump_mask"] & ~batch.last_pairs(), batch.pair_offsets)
+
+
+@batch_registry.intermediate("burst_runs", needs=["batch", "burst_mask"])
+def batch_burst_runs(ctx):
+    batch = ctx["batch"]
+    return feature_batch.segment_runs(ctx["burst_mask"] & ~batch.last_pairs(), batch.pair_offsets)
+
+
+# Per-map (count, total, longest) of the jump runs, the long burst runs (streams) and the rest of the burst runs that count
+@batch_registry.intermediate("jump_run_stats", needs=["batch", "jump_runs"])
+def batch_jump_run_stats(ctx):
+    starts, lengths, segments = ctx["jump_runs"]
+    return feature_batch.run_stats(lengths, segments, len(ctx["batch"]))
+
+
+@batch_registry.intermediate("long_burst_run_stats", needs=["batch", "burst_runs"])
+def batch_long_burst_run_stats(ctx):
+    starts, lengths, segments = ctx["burst_runs"]
+    keep = lengths >= STREAM_RUN
+    return feature_batch.run_stats(lengths[keep], segments[keep], len(ctx["batch"]))
+
+
+@batch_registry.intermediate("short_burst_run_stats", needs=["batch", "burst_runs"])
+def batch_short_burst_run_stats(ctx):
+    starts, lengths, segments = ctx["burst_runs"]
+    keep = (lengths >= BURST_MIN_RUN) & (lengths < STREAM_RUN)
+    return feature_batch.run_stats(lengths[keep], segments[keep], len(ctx["batch"]))
+
+
+# (a list, missing stats stay an int -1 like in difficulty_stat)
+def batch_difficulty_stat(ctx, key):
+    return [difficulty_stat({"difficulty": diff}, key) for diff in ctx["batch"].difficulty]
+
+
+for name, key in [("hp_drain", "HPDrainRate"), ("circle_size", "CircleSize"), ("overall_difficulty", "OverallDifficulty"),
+                  ("approach_rate", "ApproachRate"), ("slider_multiplier", "SliderMultiplier"), ("slider_tick_rate", "SliderTickRate")]:
+    batch_registry.feature(name, needs=["batch"])(functools.partial(batch_difficulty_stat, key=key))
+
+
+@batch_registry.feature("jump_confidence", needs=["n_hits", "closed_jump_runs"])
+def batch_jump_confidence(ctx):
+    starts, lengths, segments = ctx["closed_jump_runs"]
+    return patterns.pattern_confidence_batch(lengths, segments, ctx["n_hits"],
+        min_length = JUMP_MIN_RUN, large_length = JUMP_LARGE_RUN, max_length_scale = 8.0)
+
+
+@batch_registry.feature("stream_confidence", needs=["n_hits", "closed_stream_runs"])
+def batch_stream_confidence(ctx):
+    starts, lengths, segments = ctx["closed_stream_runs"]
+    return patterns.pattern_confidence_batch(lengths, segments, ctx["n_hits"],
+        min_length = STREAM_MIN_RUN, large_length = STREAM_LARGE_RUN, max_length_scale = 13.0)
+
+
+@batch_registry.feature("jump_count", needs=["jump_run_stats"])
+def batch_jump_count(ctx):
+    return ctx["jump_run_stats"][1]
+
+
+@batch_registry.feature("small_jumps_instances", needs=["batch", "jump_runs"])
+def batch_small_jumps_instances(ctx):
+    starts, lengths, segments = ctx["jump_runs"]
+    return np.bincount(segments[lengths < SMALL_JUMP_RUN], minlength=len(ctx["batch"]))
+
+
+@batch_registry.feature("medium_jumps_instances", needs=["batch", "jump_runs"])
+def batch_medium_jumps_instances(ctx):
+    starts, lengths, segments = ctx["jump_runs"]
+    return np.bincount(segments[(lengths >= SMALL_JUMP_RUN) & (lengths < MEDIUM_JUMP_RUN)], minlength=len(ctx["batch"]))
+
+
+@batch_registry.feature("large_jumps_instances", needs=["batch", "jump_runs"])
+def batch_large_jumps_instances(ctx):
+    starts, lengths, segments = ctx["jump_runs"]
+    return np.bincount(segments[lengths >= MEDIUM_JUMP_RUN], minlength=len(ctx["batch"]))
+
+
+@batch_registry.feature("total_jump_instances", needs=["jump_run_stats"])
+def batch_total_jump_instances(ctx):
+    return ctx["jump_run_stats"][0]
+
+
+@batch_registry.feature("jump_density", needs=["n_hits", "jump_run_stats"])
+def batch_jump_density(ctx):
+    return ctx["jump_run_stats"][1] / ctx["n_hits"]
+
+
+@batch_registry.feature("burst_count", needs=["short_burst_run_stats"])
+def batch_burst_count(ctx):
+    return ctx["short_burst_run_stats"][1]
+
+
+@batch_registry.feature("burst_instances", needs=["short_burst_run_stats"])
+def batch_burst_instances(ctx):
+    return ctx["short_burst_run_stats"][0]
+
+
+@batch_registry.feature("burst_density", needs=["n_hits", "short_burst_run_stats"])
+def batch_burst_density(ctx):
+    return ctx["short_burst_run_stats"][1] / ctx["n_hits"]
+
+
+@batch_registry.feature("stream_count", needs=["long_burst_run_stats"])
+def batch_stream_count(ctx):
+    return ctx["long_burst_run_stats"][1]
+
+
+@batch_registry.feature("stream_instances", needs=["long_burst_run_stats"])
+def batch_stream_instances(ctx):
+    return ctx["long_burst_run_stats"][0]
+
+
+@batch_registry.feature("stream_density", needs=["n_hits", "long_burst_run_stats"])
+def batch_stream_density(ctx):
+    return ctx["long_burst_run_stats"][1] / ctx["n_hits"]
+
+
+@batch_registry.feature("fast_density", needs=["batch", "n_hits", "time_diffs"])
+def batch_fast_density(ctx):
+    return feature_batch.segment_sum(ctx["time_diffs"] < SPEED_THRESHOLD, ctx["batch"].pair_offsets) / ctx["n_hits"]
+
+
+@batch_registry.feature("peak_nps", needs=["batch", "strain"])
+def batch_peak_nps(ctx):
+    return np.maximum.reduceat(ctx["strain"], ctx["batch"].hit_offsets[:-1])
+
+
+@batch_registry.feature("peak_jump_density", needs=["batch", "window_jump_density"])
+def batch_peak_jump_density(ctx):
+    return np.maximum.reduceat(ctx["window_jump_density"], ctx["batch"].hit_offsets[:-1])
+
+
+def batch_strain_section(ctx, section):
+    return ctx["strain_sections"][:, section]
 
 
+for n in range(STRAIN_SECTIONS):
+    batch_registry.feature(f"strain_section_{n + 1}", needs=["strain_sections"])(functools.partial(batch_strain_section, section=n))
 
 
 if __name__ == "__main__":
-    extract_features_from_folder(config.map_folder)
+    instrumentation.setup_logging()
+    with instrumentation.instrumented_run("extract", os.path.splitext(config.extraction_file)[0] + "_stats.json"):
+        extract_features_from_folder(config.map_folder)
 
 
 
@@ -0,0 +1,99 @@
+###########################
+# This module reads and writes extracted feature tables.
+# The format is picked from the file extension: .csv (default), .parquet, .feather or .npz.
+# Binary formats store the feature columns as float32 so the handoff to clustering skips text parsing.
+# Large tables can also be read in chunks so they never have to fit in memory at once.
+# (.parquet and .feather need pyarrow installed, .npz only needs numpy)
+###########################
+
+# Python library imports
+import os
+import numpy as np
+import pandas as pd
+
+# Column that identifies each map (every other column is a feature)
+ID_COLUMN = "map_id"
+
+FORMATS = {".csv", ".parquet", ".feather", ".npz"}
+
+
+# Function to get the format of a feature file from its extension
+def file_format(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in FORMATS:
+        raise ValueError(f"Unsupported feature file format '{ext}' (expected one of {sorted(FORMATS)})")
+    return ext
+
+
+# Function to cast every feature column to float32 (the id column is left alone)
+def to_float32(df):
+    return df.astype({c: np.float32 for c in df.columns if c != ID_COLUMN})
+
+
+# Function to write a feature table
+def write_features(df, path):
+    ext = file_format(path)
+
+    if ext == ".csv":
+        df.to_csv(path, index=False)
+    elif ext == ".parquet":
+        to_float32(df).to_parquet(path, index=False)
+    elif ext == ".feather":
+        to_float32(df).reset_index(drop=True).to_feather(path)
+    elif ext == ".npz":
+        df = to_float32(df)
+        arrays = {c: df[c].to_numpy() for c in df.columns if c != ID_COLUMN}
+        if ID_COLUMN in df.columns:
+            arrays[ID_COLUMN] = df[ID_COLUMN].to_numpy(dtype=str)
+
+        # np.savez adds .npz itself, write through a file object to keep the exact path
+        with open(path, "wb") as f:
+            np.savez(f, __columns__=np.array(list(df.columns)), **arrays)
+
+
+# Function to read a feature table written by write_features
+def read_features(path, columns = None):
+    ext = file_format(path)
+
+    if ext == ".csv":
+        return pd.read_csv(path, usecols=columns)
+    if ext == ".parquet":
+        return pd.read_parquet(path, columns=columns)
+    if ext == ".feather":
+        return pd.read_feather(path, columns=columns)
+
+    with np.load(path, allow_pickle=False) as data:
+        names = [str(c) for c in data["__columns__"]]
+        if columns is not None:
+            names = [c for c in names if c in columns]
+        return pd.DataFrame({c: data[c] for c in names})
+
+
+# Function to read a feature table in chunks of about chunk_size rows
+# csv, parquet and feather are streamed from disk, npz is loaded once and then sliced
+def iter_feature_chunks(path, chunk_size = 100000):
+    ext = file_format(path)
+
+    if ext == ".csv":
+        yield from pd.read_csv(path, chunksize=chunk_size)
+
+    elif ext == ".parquet":
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+
+    elif ext == ".feather":
+        # feather files are Arrow IPC files, read them batch by batch from a memory map
+        import pyarrow as pa
+        import pyarrow.ipc as ipc
+        with pa.memory_map(path) as source:
+            reader = ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                for start in range(0, batch.num_rows, chunk_size):
+                    yield batch.slice(start, chunk_size).to_pandas()
+
+    else:
+        df = read_features(path)
+        for start in range(0, len(df), chunk_size):
+            yield df.iloc[start:start + chunk_size]
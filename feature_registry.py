@@ -0,0 +1,124 @@
+###########################
+# This module computes features from the intermediates they declare.
+# Intermediates (spacing, time deltas, beat lengths, run masks, ...) and features are registered with
+# the intermediates and .osu sections they need. For a set of features the registry works out a plan once:
+# the sections to parse and the intermediates to compute, in dependency order.
+# Every map then gets a single parse and each intermediate is computed at most once, however many features use it.
+###########################
+
+# Python library imports
+import inspect
+import functools
+from collections import namedtuple
+import osu_parser
+from instrumentation import stats
+
+# What a map is turned into before any intermediate runs (the parsed sections)
+SECTIONS = "sections"
+
+# An intermediate or a feature: the function computing it, the intermediates it needs, the sections it reads
+Step = namedtuple("Step", ["name", "function", "needs", "sections"])
+
+# What has to be done to compute a set of features
+Plan = namedtuple("Plan", ["features", "intermediates", "sections"])
+
+
+class FeatureRegistry:
+
+    # prefix is put in front of the names of the timings recorded in the run stats
+    def __init__(self, prefix = ""):
+        self.prefix = prefix
+        self.intermediates = {}
+        self.features = {}
+        self.plans = {}
+
+    # Decorator to register an intermediate, computed from the intermediates before it
+    def intermediate(self, name, needs = (), sections = ()):
+        def register(function):
+            self.intermediates[name] = Step(name, function, tuple(needs), tuple(sections))
+            self.plans = {}
+            return function
+        return register
+
+    # Decorator to register a feature (a number computed from intermediates)
+    def feature(self, name, needs = (), sections = ()):
+        def register(function):
+            self.features[name] = Step(name, function, tuple(needs), tuple(sections))
+            self.plans = {}
+            return function
+        return register
+
+    # Function to work out the sections and intermediates a set of features needs (cached per set)
+    # intermediates named in given are already there, so they (and what they need) are left out
+    def plan(self, features, given = ()):
+        features, given = tuple(features), tuple(given)
+        if (features, given) in self.plans:
+            return self.plans[features, given]
+
+        unknown = [name for name in features if name not in self.features]
+        if unknown:
+            raise ValueError(f"Unknown features {unknown} (expected some of {sorted(self.features)})")
+
+        # depth-first walk over the needs, so every intermediate comes after the ones it uses
+        order = []
+        sections = []
+        visiting = set()
+
+        def visit(step):
+            for section in step.sections:
+                if section not in sections:
+                    sections.append(section)
+            for need in step.needs:
+                if need in order or need in given:
+                    continue
+                if need in visiting:
+                    raise ValueError(f"Intermediate '{need}' depends on itself")
+                if need not in self.intermediates:
+                    raise ValueError(f"'{step.name}' needs unknown intermediate '{need}'")
+                visiting.add(need)
+                visit(self.intermediates[need])
+                visiting.discard(need)
+                order.append(need)
+
+        for name in features:
+            visit(self.features[name])
+
+        plan = Plan(features, tuple(order), tuple(sections))
+        self.plans[features, given] = plan
+        return plan
+
+    # Function to compute a set of features for one map (path, bytes or memory-mapped slice)
+    def compute(self, map_file, features):
+        plan = self.plan(features)
+
+        with stats.timer(self.prefix + "parse_time"):
+            values = {SECTIONS: osu_parser.parse_osu(map_file, plan.sections)}
+
+        return self.evaluate(values, features)
+
+    # Function to compute a set of features from values computed beforehand (sections and/or intermediates)
+    def evaluate(self, values, features):
+        plan = self.plan(features, [name for name in values if name != SECTIONS])
+
+        for name in plan.intermediates:
+            with stats.timer(self.prefix + "intermediate_time." + name):
+                values[name] = self.intermediates[name].function(values)
+
+        result = {}
+        for name in plan.features:
+            with stats.timer(self.prefix + "feature_time." + name):
+                result[name] = self.features[name].function(values)
+        return result
+
+    # Function to get the source code behind a set of features (used to stamp cached features)
+    def source(self, features, given = ()):
+        plan = self.plan(features, given)
+        steps = [self.intermediates[name] for name in plan.intermediates] + [self.features[name] for name in plan.features]
+        return "\n".join(function_source(step.function) for step in steps)
+
+
+# Function to get the source code of a step function (for a functools.partial, the wrapped function and its arguments)
+def function_source(function):
+    if isinstance(function, functools.partial):
+        return inspect.getsource(function.func) + repr((function.args, sorted(function.keywords.items())))
+    return inspect.getsource(function)
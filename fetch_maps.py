@@ -9,8 +9,10 @@ import requests
 import zipfile
 import io
 import os
+import hashlib
 import random
-import datetime
+import queue
+import threading
 from concurrent.futures import ThreadPoolExecutor
 
 # Osu API
@@ -19,126 +21,291 @@ from osu import Client
 
 # import config
 import config
+import http_session
+import osu_parser
+import download_manifest
+import map_store
+import instrumentation
+from instrumentation import log, stats
 
 # file-specific configurations!!
 NUM_MAPS = 5000 #number of maps to fetch (including what is already there)
+DOWNLOAD_WORKERS = 16 #number of maps downloaded at the same time
+MAP_ID_QUEUE_SIZE = 200 #map ids waiting to be downloaded
+ARCHIVE_QUEUE_SIZE = 32 #downloaded archives waiting to be extracted (bounds memory)
+MANIFEST_FILE = os.path.normpath(config.map_folder) + "_manifest.sqlite" #record of every beatmapset attempted
+MAP_STORE_LAYOUT = None #"flat", "sharded" or "packed" for a new map folder (None keeps the layout of the folder, flat if new)
+STATS_FILE = os.path.normpath(config.map_folder) + "_fetch_stats.json" #summary of the last run (counters, timings)
 
 
 # Set up the osu! API client
 client = Client.from_credentials(config.osu_api_client_id, config.osu_api_client_secret, config.osu_api_redirect_uri)
 
+# Shared download session (one keep-alive connection per download thread)
+session = http_session.PooledSession(pool_size=DOWNLOAD_WORKERS)
 
-# Function to print with timestamp
-def tsprint(s):
-    print("[" + datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S") + "] " + s)
+# Where the accepted .osu files go, and the record of every beatmapset attempted (skip checks and progress counts come from here)
+# both are opened by open_outputs when fetching starts, so importing this module leaves the map folder alone
+store = None
+manifest = None
 
 
-# Fetcher function to fetch a map
-def fetch_map(map_id, difficulty_threshold = 5.0):
-    tsprint(f'Fetching map {map_id}...')
+# Function to open the map store and the manifest (if they were not opened or set already)
+def open_outputs():
+    global store, manifest
+    if store is None:
+        store = map_store.open_store(config.map_folder, MAP_STORE_LAYOUT)
+    if manifest is None:
+        manifest = download_manifest.Manifest(MANIFEST_FILE, store)
 
-    # Check if that map is already in the folder
-    if os.path.exists(config.map_folder + map_id + "_0.osu"):
-        tsprint(f'Map {map_id} is already in the folder!')
-        return
 
-    # Try to fetch the map
+# Function to download the archive of a beatmapset (returns None if the download failed)
+def download_map(map_id):
     try:
-        # Fetch the map
-        response = requests.get(os.path.join(config.api_link, map_id))
-        response.raise_for_status()
-        tsprint(f'Successfully fetched map {map_id}!')
-    except:
-        tsprint(f'Failed to fetch map {map_id} - got status code {response.status_code}')
-        return
-    
+        with stats.timer("download.latency"):
+            response = session.get(os.path.join(config.api_link, map_id))
+            response.raise_for_status()
+            content = response.content
+        stats.count("download.ok")
+        stats.count("download.bytes", len(content))
+        log.debug(f'Successfully fetched map {map_id}!')
+        return content
+    except requests.exceptions.HTTPError as e:
+        reason = f'got status code {e.response.status_code}'
+    except requests.exceptions.RequestException as e:
+        reason = f'{type(e).__name__}: {e}'
+
+    stats.count("download.failed")
+    log.warning(f'Failed to fetch map {map_id} - {reason}')
+    manifest.record(map_id, download_manifest.FAILED, rejections={"download": reason})
+    return None
+
+
+# Function to get the size and hash of an archive (bytes or file object)
+def archive_digest(content):
+    if isinstance(content, bytes):
+        return len(content), hashlib.sha1(content).hexdigest()
+
+    h = hashlib.sha1()
+    nbytes = 0
+    for block in iter(lambda: content.read(1 << 20), b""):
+        h.update(block)
+        nbytes += len(block)
+    content.seek(0)
+    return nbytes, h.hexdigest()
+
+
+# Function to check a difficulty inside an archive without extracting it
+# only the [General] and [Difficulty] headers are read, returns None if the map is accepted or the reason it is not
+def check_difficulty(zip_file, file, difficulty_threshold = 5.0):
+    with zip_file.open(file) as raw:
+        lines = io.TextIOWrapper(raw, encoding='utf-8', errors='replace')
+        sections = osu_parser.parse_sections(lines, ["General", "Difficulty"])
+
+    # Confirm that the file is the right type of map (not mania or taiko)
+    mode = sections.get("General", {}).get("Mode")
+    if mode is None:
+        return "no mode line"
+    try:
+        mode = int(mode)
+    except ValueError:
+        return "bad mode line"
+    if mode != 0:
+        return "not a standard map"
+
+    difficulty = sections.get("Difficulty", {}).get("OverallDifficulty")
+    if difficulty is None:
+        return "no overall difficulty"
+    try:
+        difficulty = float(difficulty)
+    except ValueError:
+        return "bad overall difficulty"
+    if difficulty < difficulty_threshold:
+        return "below difficulty threshold"
+
+    return None
+
+
+# Function to extract the .osu files of a downloaded archive (returns how many were kept)
+# content is either the archive bytes or a file object holding them
+def extract_map(map_id, content, difficulty_threshold = 5.0):
+    with stats.timer("extract.archive_time"):
+        return extract_archive(map_id, content, difficulty_threshold)
+
+
+# Function doing the work of extract_map (kept apart so the whole archive is timed)
+def extract_archive(map_id, content, difficulty_threshold):
+    nbytes, content_hash = archive_digest(content)
+
     # Extract the map in memory
     try:
-        zip_file = zipfile.ZipFile(io.BytesIO(response.content))
+        zip_file = zipfile.ZipFile(io.BytesIO(content) if isinstance(content, bytes) else content)
     except:
-        tsprint(f'Failed to extract map {map_id} - not a valid zip file')
-        return
+        stats.count("extract.bad_archive")
+        log.warning(f'Failed to extract map {map_id} - not a valid zip file')
+        manifest.record(map_id, download_manifest.FAILED, rejections={"archive": "not a valid zip file"}, nbytes=nbytes, content_hash=content_hash)
+        return 0
     
     count = 0 #count the number of osu files extracted from the zip
+    rejections = {} #reason each rejected .osu file was skipped
 
-    # Loop through the files in the zip and extract the .osu files
+    # Loop through the files in the zip and keep the .osu files that pass the checks
     for file in zip_file.namelist():
-        if file.endswith('.osu'):
-            zip_file.extract(file, config.map_folder)
-
-
-            # Confirm that the file is the right type of map (not mania or taiko)
-            with open(config.map_folder + file, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-                
-                # find the line that specifies the mode
-                mode_line = [line for line in lines if line.startswith("Mode:")]
-                if len(mode_line) == 0:
-                    tsprint(f'Failed to find mode line in {file}')
-                    os.remove(config.map_folder + file)
-                    return
-                
-                # check if the mode is standard
-                mode = int(mode_line[0].split(":")[1].strip())
-                if mode != 0:
-                    tsprint(f'Map {file} is not a standard map')
-                    os.remove(config.map_folder + file)
-                    return
-
-                difficulty = [line for line in lines if line.startswith("OverallDifficulty:")]
-                difficulty = int(difficulty[0].split(":")[1].strip())
-                if difficulty < difficulty_threshold: 
-                    os.remove(config.map_folder + file)
-                    return
-            
-            # Rename the file to the map_id + count + .osu
-            try:
-                os.rename(config.map_folder + file, config.map_folder + map_id + "_" + str(count) + ".osu")
-                count += 1
-            except:
-                tsprint(f'Failed to rename file {file} to {map_id}_{count}.osu')
-                os.remove(config.map_folder + file) #remove the file if it cannot be renamed
-                return
+        if not file.endswith('.osu'):
+            continue
+
+        with stats.timer("extract.check_time"):
+            reason = check_difficulty(zip_file, file, difficulty_threshold)
+        if reason is not None:
+            log.debug(f'Skipping {file} from map {map_id} - {reason}')
+            stats.count("rejected." + reason)
+            rejections[file] = reason
+            continue
+
+        # Write the file as map_id + count + .osu (the store never leaves half a map behind)
+        try:
+            store.write(map_id + "_" + str(count) + ".osu", zip_file.read(file))
+            count += 1
+        except OSError as e:
+            log.warning(f'Failed to write file {file} to {map_id}_{count}.osu - {e}')
+            stats.count("rejected.write failed")
+            rejections[file] = f"write failed: {e}"
+
+    # sets that lost difficulties to the threshold are checked again if a later run lowers it
+    status = download_manifest.ACCEPTED if count > 0 else download_manifest.REJECTED
+    threshold = difficulty_threshold if "below difficulty threshold" in rejections.values() else None
+    manifest.record(map_id, status, accepted=count, rejections=rejections, nbytes=nbytes, content_hash=content_hash, threshold=threshold)
+
+    stats.count("beatmapsets." + status)
+    stats.count("difficulties.accepted", count)
+    log.debug(f'Successfully extracted {count} osu files from map {map_id}!')
+    return count
 
-    tsprint(f'Successfully extracted {count} osu files from map {map_id}!')
-    return
 
+# Fetcher function to fetch a map
+def fetch_map(map_id, difficulty_threshold = 5.0):
+    log.debug(f'Fetching map {map_id}...')
+    open_outputs()
 
+    # Check if that map was already handled (accepted or fully rejected)
+    if manifest.is_done(map_id, difficulty_threshold):
+        log.debug(f'Map {map_id} is already in the manifest!')
+        return 0
+
+    content = download_map(map_id)
+    if content is None:
+        return 0
+
+    return extract_map(map_id, content, difficulty_threshold)
+
+
+# Function to go through the search results page by page (yields beatmapset ids)
+def search_map_ids(stop):
+    filter = osu.util.BeatmapsetSearchFilter()
+    filter.set_mode(osu.GameModeInt.STANDARD)
+    filter.set_status(osu.BeatmapsetSearchStatus.RANKED)  
+    filter.set_sort(osu.BeatmapsetSearchSort.PLAYS)
 
-# Function to fetch maps!
-def fetch_maps(num_maps = 100, difficulty_threshold = 5.0):
     page = 0
-    while True:
-        file_count = os.listdir(config.map_folder)
-        if len(file_count) >= num_maps:
+    cursor_params = {}
+    while not stop.is_set():
+        with stats.timer("search.latency"):
+            beatmapsearchresult = client.search_beatmapsets(filters={**filter.filters, **cursor_params}, page=page)
+        stats.count("search.pages")
+        log.debug(f'Fetched page {page} of maps...')
+
+        for beatmapset in beatmapsearchresult.beatmapsets:
+            yield str(beatmapset.id)
+
+        # no cursor means this was the last page
+        cursor = beatmapsearchresult.cursor
+        if not cursor or len(beatmapsearchresult.beatmapsets) == 0:
             break
 
-        # fetch maps in batches
-        filter = osu.util.BeatmapsetSearchFilter()
-        filter.set_mode(osu.GameModeInt.STANDARD)
-        filter.set_status(osu.BeatmapsetSearchStatus.RANKED)  
-        filter.set_sort(osu.BeatmapsetSearchSort.PLAYS)
+        cursor_params = {f"cursor[{key}]": value for key, value in cursor.items()}
+        page += 1
 
-        tsprint(f'Fetched page {page} of maps...')
 
-        beatmapsearchresult = client.search_beatmapsets(filters=filter)
+# Function to put an item in a bounded queue, giving up if the pipeline is stopping
+def put_until_stopped(q, item, stop):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            pass
+    return False
 
 
-        map_ids = [beatmapset.id for beatmapset in beatmapsearchresult.beatmapsets]
+# Function to fetch maps!
+# searching, downloading and extracting run at the same time, connected by bounded queues:
+#   search thread -> map ids -> download threads -> archives -> extraction (this thread)
+def fetch_maps(num_maps = 100, difficulty_threshold = 5.0, workers = DOWNLOAD_WORKERS):
+    open_outputs()
+    if manifest.accepted_count() >= num_maps:
+        log.info(f'Already have {manifest.accepted_count()} maps!')
+        return
 
-        # use concurrent threads to fetch maps
-        with ThreadPoolExecutor() as executor:
+    stop = threading.Event()
+    map_ids = queue.Queue(maxsize=MAP_ID_QUEUE_SIZE)
+    archives = queue.Queue(maxsize=ARCHIVE_QUEUE_SIZE)
+
+    # Producer: page through the search results
+    def search_stage():
+        try:
+            for map_id in search_map_ids(stop):
+                if not put_until_stopped(map_ids, map_id, stop):
+                    break
+        except Exception as e:
+            log.error(f'Search failed - {type(e).__name__}: {e}')
+        finally:
+            # one sentinel per download thread (they keep draining, so this never blocks for long)
+            for _ in range(workers):
+                map_ids.put(None)
+
+    # Download threads: skip what we already have, download the rest
+    def download_stage():
+        try:
+            for map_id in iter(map_ids.get, None):
+                if stop.is_set():
+                    continue
+                if manifest.is_done(map_id, difficulty_threshold):
+                    stats.count("download.skipped")
+                    continue
+
+                content = download_map(map_id)
+                if content is not None:
+                    archives.put((map_id, content))
+        finally:
+            archives.put(None)
+
+    with ThreadPoolExecutor(max_workers=workers + 1) as executor:
+        executor.submit(search_stage)
+        for _ in range(workers):
+            executor.submit(download_stage)
+
+        # Consumer: extract and validate the archives as they come in
+        progress = instrumentation.Progress("Maps accepted", num_maps)
+        finished = 0
+        while finished < workers:
+            item = archives.get()
+            if item is None:
+                finished += 1
+                continue
+            if stop.is_set():
+                continue
+
+            map_id, content = item
+            try:
+                extract_map(map_id, content, difficulty_threshold)
+            except Exception as e:
+                log.error(f'Failed to extract map {map_id} - {type(e).__name__}: {e}')
+            progress.update(done=manifest.accepted_count())
+            if manifest.accepted_count() >= num_maps:
+                stop.set()
 
-            # call fetcher function on each map id concurrently
-            futures = [executor.submit(fetch_map, str(map_id), difficulty_threshold) for map_id in map_ids]
+    log.info(f'Successfully fetched {manifest.accepted_count()} maps! ({manifest.summary()})')
 
-            # wait for all threads to finish
-            for future in futures:
-                future.result()
-            
-        page += 1
-    
-    tsprint(f'Successfully fetched {num_maps} maps!')
 
 # Main function...that's it
 if __name__ == "__main__":
@@ -148,4 +315,6 @@ if __name__ == "__main__":
         os.makedirs(config.map_folder)
 
     #fetch this stuff
-    fetch_maps(NUM_MAPS)
\ No newline at end of file
+    instrumentation.setup_logging()
+    with instrumentation.instrumented_run("fetch", STATS_FILE):
+        fetch_maps(NUM_MAPS)
\ No newline at end of file
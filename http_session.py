@@ -0,0 +1,64 @@
+###########################
+# This module provides a pooled HTTP session for downloading maps from many threads.
+# Connections are kept alive and shared between threads, every request has connect/read timeouts,
+# and 429/5xx responses are retried with exponential backoff, jitter and Retry-After support.
+###########################
+
+# Python library imports
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# File-specific configurations
+POOL_SIZE = 16 # connections kept open per host (match the number of download threads)
+CONNECT_TIMEOUT = 5 # seconds to open a connection
+READ_TIMEOUT = 60 # seconds to wait between bytes of the response
+
+MAX_RETRIES = 5
+BACKOFF_FACTOR = 0.5 # sleeps 0.5s, 1s, 2s, 4s, ... between retries
+BACKOFF_JITTER = 0.5 # up to this many random seconds added to each sleep
+BACKOFF_MAX = 60 # never sleep longer than this between retries
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+
+class PooledSession:
+
+    def __init__(self, pool_size = POOL_SIZE, max_retries = MAX_RETRIES, backoff_factor = BACKOFF_FACTOR,
+                 backoff_jitter = BACKOFF_JITTER, timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)):
+        self.timeout = timeout
+
+        # backoff_jitter and backoff_max need urllib3 2 (see requirements.txt)
+        retry = Retry(
+            total = max_retries,
+            backoff_factor = backoff_factor,
+            backoff_jitter = backoff_jitter,
+            backoff_max = BACKOFF_MAX,
+            status_forcelist = RETRY_STATUSES,
+            allowed_methods = ["GET", "HEAD"],
+            respect_retry_after_header = True,
+            raise_on_status = False, # hand back the last response so raise_for_status reports it
+        )
+
+        # one connection pool shared by every thread
+        self.adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry, pool_block=True)
+
+        # requests.Session is not thread-safe, so each thread gets its own session on top of the shared pool
+        self.local = threading.local()
+
+    # Function to get the session of the calling thread
+    def session(self):
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("http://", self.adapter)
+            session.mount("https://", self.adapter)
+            self.local.session = session
+        return session
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session().get(url, **kwargs)
+
+    def close(self):
+        self.adapter.close()
@@ -0,0 +1,223 @@
+###########################
+# This module holds the instrumentation shared by the fetch, extraction and clustering scripts.
+# - counters and timing histograms (bytes downloaded, download latency, parse time, time per feature, ...)
+# - leveled logging, with progress lines printed at most every few seconds instead of once per map
+# - an optional cProfile / tracemalloc hook
+# - a JSON summary of the run written when it ends
+# The log level and the profiling hooks can be set from the environment (see below).
+###########################
+
+# Python library imports
+import os
+import math
+import json
+import time
+import logging
+import threading
+import contextlib
+
+# File-specific configurations
+LOG_LEVEL = os.environ.get("OSU_LOG_LEVEL", "INFO") # DEBUG shows one line per map
+PROGRESS_INTERVAL = float(os.environ.get("OSU_PROGRESS_INTERVAL", 5)) # seconds between progress lines
+PROFILE_FILE = os.environ.get("OSU_PROFILE") # write cProfile stats of the run to this file
+TRACE_MEMORY = os.environ.get("OSU_TRACE_MEMORY", "") not in ("", "0") # record the peak Python memory of the run
+
+HISTOGRAM_BUCKETS_PER_OCTAVE = 4 # resolution of the histograms (buckets between two powers of two)
+
+log = logging.getLogger("osu_analyzer")
+
+
+# Function to set up logging for a script ("[2024-01-01 12:00:00] message", like the old timestamped prints)
+def setup_logging(level = None):
+    if not log.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s", "%Y-%m-%d %H:%M:%S"))
+        log.addHandler(handler)
+        log.propagate = False
+
+    level = level or LOG_LEVEL
+    log.setLevel(level.upper() if isinstance(level, str) else level)
+
+
+# Histogram of positive values with logarithmic buckets (fixed memory however many values are added)
+class Histogram:
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.buckets = {}
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        bucket = math.floor(math.log2(value) * HISTOGRAM_BUCKETS_PER_OCTAVE) if value > 0 else None
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+
+    # Function to estimate a percentile (upper edge of the bucket it falls in, so within ~19%)
+    def percentile(self, q):
+        target = q / 100 * self.count
+        seen = 0
+        for bucket in sorted(self.buckets, key=lambda b: -math.inf if b is None else b):
+            seen += self.buckets[bucket]
+            if seen >= target:
+                if bucket is None:
+                    return 0.0
+                return min(2 ** ((bucket + 1) / HISTOGRAM_BUCKETS_PER_OCTAVE), self.max)
+        return self.max
+
+    def summary(self):
+        if self.count == 0:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count,
+            "min": self.min,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+# Counters and histograms of a run (safe to update from several threads)
+class Stats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    # Function to add to a counter
+    def count(self, name, n = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    # Function to add a value to a histogram
+    def observe(self, name, value):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(value)
+
+    # Function to time a block of code into a histogram (seconds)
+    @contextlib.contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    # Function to take what was recorded so far and start over (used to send worker process stats to the parent)
+    def take(self):
+        with self.lock:
+            taken = (self.counters, self.histograms)
+            self.counters = {}
+            self.histograms = {}
+        return taken
+
+    # Function to add what another Stats recorded (the output of take)
+    def merge(self, taken):
+        counters, histograms = taken
+        with self.lock:
+            for name, n in counters.items():
+                self.counters[name] = self.counters.get(name, 0) + n
+            for name, histogram in histograms.items():
+                if name not in self.histograms:
+                    self.histograms[name] = Histogram()
+                self.histograms[name].merge(histogram)
+
+    def summary(self, elapsed = None):
+        with self.lock:
+            summary = {
+                "counters": dict(sorted(self.counters.items())),
+                "histograms": {name: h.summary() for name, h in sorted(self.histograms.items())},
+            }
+            if elapsed:
+                summary["elapsed"] = elapsed
+                summary["rates"] = {name: n / elapsed for name, n in sorted(self.counters.items())}
+        return summary
+
+
+# Stats of this process
+stats = Stats()
+
+
+# Progress logger that prints at most once every interval seconds
+class Progress:
+
+    def __init__(self, label, total = None, interval = PROGRESS_INTERVAL):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.start = time.perf_counter()
+        self.last = self.start
+
+    # Function to move the progress forward by n, or to set it to done
+    def update(self, n = 1, done = None):
+        self.done = self.done + n if done is None else done
+        now = time.perf_counter()
+        if now - self.last >= self.interval:
+            self.last = now
+            self.report(now)
+
+    def report(self, now = None):
+        elapsed = (now or time.perf_counter()) - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        of_total = f"/{self.total}" if self.total is not None else ""
+        log.info(f"{self.label}: {self.done}{of_total} ({rate:.1f}/s)")
+
+    def finish(self):
+        self.report()
+
+
+# Function to instrument a whole run: profiling hooks while it runs, JSON summary when it ends
+# profile_file writes cProfile stats (open with pstats), trace_memory records the peak Python memory
+@contextlib.contextmanager
+def instrumented_run(name, summary_file = None, profile_file = PROFILE_FILE, trace_memory = TRACE_MEMORY):
+    profiler = None
+    if profile_file:
+        import cProfile
+        profiler = cProfile.Profile()
+    if trace_memory:
+        import tracemalloc
+        tracemalloc.start()
+
+    stats.take() # the summary only covers this run
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield stats
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_file)
+            log.info(f"Wrote profile to {profile_file}")
+
+        summary = {"run": name, "finished": time.strftime("%Y-%m-%d %H:%M:%S")}
+        summary.update(stats.summary(time.perf_counter() - start))
+        if trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            summary["memory"] = {"current_bytes": current, "peak_bytes": peak}
+
+        if summary_file is not None:
+            with open(summary_file, "w", encoding="utf-8") as f:
+                json.dump(summary, f, indent=2)
+            log.info(f"Wrote run summary to {summary_file}")
@@ -0,0 +1,277 @@
+###########################
+# This module stores the .osu files of the corpus on disk.
+# Three layouts share the same interface (write/read/exists/iter_names):
+#   flat    - every map in one folder as <map_id>_<n>.osu (the original layout)
+#   sharded - maps spread over hashed subfolders so no folder gets too big
+#   packed  - maps appended to large pack files, with an append-only offset index
+# The layout of an existing store is detected from the marker file in its root.
+###########################
+
+# Python library imports
+import os
+import mmap
+import hashlib
+import threading
+from collections import namedtuple
+import osu_parser
+
+LAYOUTS = ["flat", "sharded", "packed"]
+LAYOUT_FILE = ".layout" # marker file holding the layout of the store
+
+SHARD_CHARS = 2 # hex characters of the shard folder name (2 -> 256 shards)
+
+PACK_MAX_BYTES = 1 << 30 # start a new pack file after this many bytes
+PACK_INDEX = "index.tsv" # name, pack number, offset, length (one line per map written)
+
+# Reference to a map inside a pack file (small enough to send to worker processes)
+PackedRef = namedtuple("PackedRef", ["pack_file", "offset", "length"])
+
+
+# Memory-maps pack files once per process and hands out slices of them without copying
+# every worker process maps the same files, so they all read through the same page cache
+class PackReader:
+
+    def __init__(self):
+        self.mappings = {}
+
+    def mapping(self, pack_file, needed):
+        mm = self.mappings.get(pack_file)
+
+        # the pack grew since it was mapped (maps were appended), map it again
+        if mm is None or len(mm) < needed:
+            if mm is not None:
+                mm.close()
+            with open(pack_file, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.mappings[pack_file] = mm
+        return mm
+
+    # Function to get a map as a window into the mapped pack file
+    def slice(self, ref):
+        mm = self.mapping(ref.pack_file, ref.offset + ref.length)
+        return osu_parser.MappedSlice(mm, ref.offset, ref.offset + ref.length)
+
+    # Function to get a copy of a map's bytes
+    def read(self, ref):
+        return self.mapping(ref.pack_file, ref.offset + ref.length)[ref.offset:ref.offset + ref.length]
+
+    def close(self):
+        for mm in self.mappings.values():
+            mm.close()
+        self.mappings = {}
+
+
+# Pack reader of this process
+reader = PackReader()
+
+
+# Store with every map in one folder
+class FlatMapStore:
+    layout = "flat"
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    # Function to list the maps lazily
+    def iter_names(self):
+        if not os.path.isdir(self.root):
+            return
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.name.endswith(".osu") and entry.is_file():
+                    yield entry.name
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    def read(self, name):
+        with open(self.path(name), "rb") as f:
+            return f.read()
+
+    # Function to write a map (through a temporary file, so a crash never leaves half a map)
+    def write(self, name, data):
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+    # What extract_features is given for a map
+    def source(self, name):
+        return self.path(name)
+
+    # Unique key of a map (used by the feature cache)
+    def key(self, name):
+        return os.path.abspath(self.path(name))
+
+    # (size, stamp) that changes whenever the map is rewritten
+    def fingerprint(self, name):
+        stat = os.stat(self.path(name))
+        return stat.st_size, stat.st_mtime_ns
+
+
+# Store with the maps spread over hashed subfolders (all difficulties of a set share a subfolder)
+class ShardedMapStore(FlatMapStore):
+    layout = "sharded"
+
+    def shard(self, name):
+        map_id = name.split("_")[0]
+        return hashlib.md5(map_id.encode()).hexdigest()[:SHARD_CHARS]
+
+    def path(self, name):
+        return os.path.join(self.root, self.shard(name), name)
+
+    def iter_names(self):
+        if not os.path.isdir(self.root):
+            return
+        for shard in sorted(os.listdir(self.root)):
+            shard_path = os.path.join(self.root, shard)
+            if not os.path.isdir(shard_path):
+                continue
+            with os.scandir(shard_path) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".osu") and entry.is_file():
+                        yield entry.name
+
+
+# Store with the maps appended to large pack files
+class PackedMapStore:
+    layout = "packed"
+
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        self.index = {} # name -> (pack number, offset, length)
+        self.pack = 0
+        self.pack_size = 0
+
+        # later lines win, so rewriting a map just appends it again
+        index_file = os.path.join(root, PACK_INDEX)
+        if os.path.exists(index_file):
+            with open(index_file, "r+b") as f:
+                data = f.read()
+
+                # a crash can leave a torn last line (no newline), cut it off so the next write starts a new line
+                if data and not data.endswith(b"\n"):
+                    data = data[:data.rfind(b"\n") + 1]
+                    f.truncate(len(data))
+
+            for line in data.decode("utf-8").split("\n"):
+                fields = line.split("\t")
+                if len(fields) != 4:
+                    continue
+                name, pack, offset, length = fields
+                self.index[name] = (int(pack), int(offset), int(length))
+                self.pack = max(self.pack, int(pack))
+
+        if os.path.exists(self.pack_path(self.pack)):
+            self.pack_size = os.path.getsize(self.pack_path(self.pack))
+
+    def pack_path(self, pack):
+        return os.path.join(self.root, f"pack_{pack:05d}.osupack")
+
+    def iter_names(self):
+        yield from list(self.index)
+
+    def exists(self, name):
+        return name in self.index
+
+    def read(self, name):
+        return reader.read(self.source(name))
+
+    # Function to append a map (the data is on disk before the index points at it)
+    def write(self, name, data):
+        with self.lock:
+            if self.pack_size > 0 and self.pack_size + len(data) > PACK_MAX_BYTES:
+                self.pack += 1
+                self.pack_size = 0
+
+            offset = self.pack_size
+            with open(self.pack_path(self.pack), "ab") as f:
+                f.write(data)
+            self.pack_size += len(data)
+
+            with open(os.path.join(self.root, PACK_INDEX), "a", encoding="utf-8") as f:
+                f.write(f"{name}\t{self.pack}\t{offset}\t{len(data)}\n")
+            self.index[name] = (self.pack, offset, len(data))
+
+    def source(self, name):
+        pack, offset, length = self.index[name]
+        return PackedRef(self.pack_path(pack), offset, length)
+
+    def key(self, name):
+        return os.path.abspath(self.root) + "#" + name
+
+    def fingerprint(self, name):
+        pack, offset, length = self.index[name]
+        return length, (pack << 40) + offset
+
+
+STORES = {"flat": FlatMapStore, "sharded": ShardedMapStore, "packed": PackedMapStore}
+
+
+# Function to get the layout of an existing store (folders without a marker are flat)
+def detect_layout(root):
+    marker = os.path.join(root, LAYOUT_FILE)
+    if os.path.exists(marker):
+        with open(marker, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    return "flat"
+
+
+# Function to open a store, creating it with the given layout if it does not exist yet
+def open_store(root, layout = None):
+    existing = detect_layout(root)
+    if layout is None:
+        layout = existing
+    if layout not in STORES:
+        raise ValueError(f"Unknown map store layout '{layout}' (expected one of {LAYOUTS})")
+
+    if layout != existing:
+        # a flat folder that already has maps cannot silently become another layout
+        if existing != "flat" or next(FlatMapStore(root).iter_names(), None) is not None:
+            raise ValueError(f"Map store {root} uses the {existing} layout, not {layout} (use migrate to convert it)")
+
+        os.makedirs(root, exist_ok=True)
+        with open(os.path.join(root, LAYOUT_FILE), "w", encoding="utf-8") as f:
+            f.write(layout + "\n")
+
+    return STORES[layout](root)
+
+
+# Function to turn what extract_features is given into something osu_parser can read
+# file paths are left alone, a PackedRef becomes a zero-copy slice of the memory-mapped pack file
+def resolve(source):
+    if isinstance(source, PackedRef):
+        return reader.slice(source)
+    return source
+
+
+# Function to read the raw bytes of a map source (a file path or a PackedRef)
+def load(source):
+    if isinstance(source, PackedRef):
+        return reader.read(source)
+    with open(source, "rb") as f:
+        return f.read()
+
+
+# Function to go through every map of a packed store as zero-copy slices, in pack order
+# (reads each pack front to back, which is the fastest way through a large corpus)
+def iter_packed(store):
+    refs = sorted(((store.source(name), name) for name in store.iter_names()), key=lambda item: (item[0].pack_file, item[0].offset))
+    for ref, name in refs:
+        yield name, reader.slice(ref)
+
+
+# Function to copy every map of a store into a new store with another layout
+def migrate(src_root, dst_root, layout):
+    src = open_store(src_root)
+    dst = open_store(dst_root, layout)
+    count = 0
+    for name in src.iter_names():
+        dst.write(name, src.read(name))
+        count += 1
+    return count
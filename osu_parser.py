@@ -0,0 +1,134 @@
+###########################
+# This module parses .osu files in a single streaming pass.
+# Lines are dispatched by their section header, every line is split exactly once,
+# and parsing stops as soon as all of the requested sections have been read.
+# Maps already in memory (bytes, or slices of a memory-mapped pack file) are parsed straight from the buffer.
+###########################
+
+# Python library imports
+from collections import namedtuple
+
+# Sections made of "key: value" lines (every other section is comma-separated)
+KEY_VALUE_SECTIONS = {"General", "Editor", "Metadata", "Difficulty", "Colours"}
+
+
+# Function to parse an iterable of .osu lines into sections
+# key-value sections become dicts, comma-separated sections become lists of split rows
+def parse_sections(lines, sections = None):
+    remaining = set(sections) if sections is not None else None
+    parsed = {}
+
+    name = None
+    rows = None # rows of the current section (None if it is being skipped)
+    is_key_value = False
+
+    for line in lines:
+        line = line.strip()
+
+        # skip blank lines and comments
+        if not line or line.startswith("//"):
+            continue
+
+        # section header
+        if line[0] == "[" and line[-1] == "]":
+
+            # the previous section is complete, stop if nothing else is needed
+            if remaining is not None:
+                remaining.discard(name)
+                if not remaining:
+                    break
+
+            name = line[1:-1]
+            if remaining is None or name in remaining:
+                is_key_value = name in KEY_VALUE_SECTIONS
+                rows = {} if is_key_value else []
+                parsed[name] = rows
+            else:
+                rows = None
+            continue
+
+        if rows is None:
+            continue
+
+        if is_key_value:
+            key, _, value = line.partition(":")
+            rows[key.strip()] = value.strip()
+        else:
+            rows.append(line.split(","))
+
+    return parsed
+
+
+# Window into a larger buffer holding a map (e.g. a slice of a memory-mapped pack file)
+MappedSlice = namedtuple("MappedSlice", ["buffer", "start", "end"])
+
+
+# Function to find the sections of a map inside a buffer without copying it
+# yields (name, body start, body end) for each section, in file order
+def section_spans(buf, start, end):
+    if buf[start:start + 1] == b"[":
+        header = start
+    else:
+        # a match from find points at the newline before the header (even when the slice starts with it)
+        header = buf.find(b"\n[", start, end)
+        if header != -1:
+            header += 1
+
+    while header != -1:
+        header_end = buf.find(b"\n", header, end)
+        if header_end == -1:
+            header_end = end
+        name = bytes(buf[header + 1:header_end]).strip().rstrip(b"]").decode("utf-8", errors="replace")
+
+        next_header = buf.find(b"\n[", header_end, end)
+        body_end = next_header + 1 if next_header != -1 else end
+        yield name, header_end + 1, body_end
+
+        header = next_header + 1 if next_header != -1 else -1
+
+
+# Function to parse a map held in a buffer (bytes or mmap), optionally only reading some sections
+# only the requested sections are copied out of the buffer, and the fields of comma-separated
+# sections stay bytes (int() and float() read them directly, no decoding needed)
+def parse_buffer(buf, sections = None, start = 0, end = None):
+    if end is None:
+        end = len(buf)
+    remaining = set(sections) if sections is not None else None
+    parsed = {}
+
+    for name, body_start, body_end in section_spans(buf, start, end):
+        if remaining is not None:
+            if name not in remaining:
+                continue
+            remaining.discard(name)
+
+        lines = buf[body_start:body_end].split(b"\n")
+        if name in KEY_VALUE_SECTIONS:
+            rows = {}
+            for line in lines:
+                line = line.strip()
+                if line and not line.startswith(b"//"):
+                    key, _, value = line.decode("utf-8", errors="replace").partition(":")
+                    rows[key.strip()] = value.strip()
+        else:
+            rows = [line.strip().split(b",") for line in lines if line.strip() and not line.startswith(b"//")]
+        parsed[name] = rows
+
+        # stop as soon as everything requested has been read
+        if remaining is not None and not remaining:
+            break
+
+    return parsed
+
+
+# Function to parse a .osu file, optionally only reading some sections (e.g. ["Difficulty"])
+# map_file is a path, the raw bytes of a map or a MappedSlice
+def parse_osu(map_file, sections = None):
+    if isinstance(map_file, MappedSlice):
+        return parse_buffer(map_file.buffer, sections, map_file.start, map_file.end)
+    if isinstance(map_file, (bytes, bytearray)):
+        return parse_buffer(map_file, sections)
+
+    # bytes that are not UTF-8 (old maps with Latin-1 metadata) are replaced, like parse_buffer does
+    with open(map_file, "r", encoding="utf-8", errors="replace") as f:
+        return parse_sections(f, sections)
@@ -0,0 +1,80 @@
+###########################
+# This module detects runs of consecutive patterns (jumps, streams, ...) in a map.
+# Everything works on boolean masks over consecutive hit object pairs, using run-length encoding
+# instead of stepping through the pairs one by one.
+###########################
+
+# Python library imports
+import numpy as np
+
+
+# Function to find every run of True values in a mask
+# returns the start index and the length of each run
+def find_runs(mask):
+    mask = np.asarray(mask, dtype=bool)
+    if len(mask) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty
+
+    # +1 where a run starts, -1 where it ends
+    edges = np.diff(np.concatenate(([0], mask.view(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    return starts, ends - starts
+
+
+# Function to get the lengths of runs that are closed by a non-matching pair
+# a run still going at the end of the map is never closed, so it is not counted
+def closed_run_lengths(mask):
+    starts, lengths = find_runs(mask)
+    if len(lengths) > 0 and mask[-1]:
+        lengths = lengths[:-1]
+    return lengths
+
+
+# Function to turn run lengths into a confidence score between 0 and 1
+# runs shorter than min_length are ignored, runs of at least large_length count as large
+def pattern_confidence(run_lengths, n_hits, min_length, large_length, max_length_scale, average_length_scale = 7.0):
+    runs = run_lengths[run_lengths >= min_length]
+
+    run_count = len(runs)
+    runs_total = int(runs.sum())
+    large_runs = int(np.count_nonzero(runs >= large_length))
+
+    density = runs_total / n_hits
+    large_density = large_runs / run_count if run_count > 0 else 0
+    average_length = runs_total / run_count if run_count > 0 else 0
+    max_length = int(runs.max()) if run_count > 0 else 0
+
+    return min((density * 0.3)
+    + (large_density * 0.4)
+    + (min(average_length / average_length_scale, 1.0) * 0.3)
+    + (min(max_length / max_length_scale, 1.0) * 0.3)
+    , 1.0)
+
+
+# Function to compute pattern_confidence for many maps at once
+# run_lengths/run_segments are the runs of every map (see feature_batch.segment_runs), n_hits is per map
+def pattern_confidence_batch(run_lengths, run_segments, n_hits, min_length, large_length, max_length_scale, average_length_scale = 7.0):
+    n_hits = np.asarray(n_hits)
+    keep = run_lengths >= min_length
+    runs, segments = run_lengths[keep], run_segments[keep]
+
+    run_count = np.bincount(segments, minlength=len(n_hits))
+    runs_total = np.bincount(segments, weights=runs, minlength=len(n_hits))
+    large_runs = np.bincount(segments, weights=runs >= large_length, minlength=len(n_hits))
+    max_length = np.zeros(len(n_hits))
+    np.maximum.at(max_length, segments, runs)
+
+    # maps without runs get 0 for the ratios, like pattern_confidence
+    has_runs = run_count > 0
+    density = runs_total / n_hits
+    large_density = np.divide(large_runs, run_count, out=np.zeros(len(n_hits)), where=has_runs)
+    average_length = np.divide(runs_total, run_count, out=np.zeros(len(n_hits)), where=has_runs)
+
+    return np.minimum((density * 0.3)
+    + (large_density * 0.4)
+    + (np.minimum(average_length / average_length_scale, 1.0) * 0.3)
+    + (np.minimum(max_length / max_length_scale, 1.0) * 0.3)
+    , 1.0)
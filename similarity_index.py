@@ -0,0 +1,189 @@
+###########################
+# This script builds and queries a "maps like this" index over extracted features.
+# The features are standardized like create_clusters.py does, and a KD tree (or ball tree) is built over them.
+# The tree is saved with the scaler parameters and the map ids, so queries don't need the feature file again.
+# Maps can be looked up by map id (maps in the index) or by .osu file (features are extracted on the fly).
+# Usage: python similarity_index.py build, then python similarity_index.py query <map id or .osu file> ... (see --help)
+###########################
+
+# Python library imports
+import os
+import time
+import pickle
+import argparse
+import numpy as np
+from sklearn.neighbors import KDTree, BallTree
+import config
+import instrumentation
+from instrumentation import log, stats
+
+# File-specific configurations
+INDEX_FILE = os.path.splitext(config.extraction_file)[0] + "_index.pkl"
+NEIGHBORS = 20 # maps returned per query
+TREES = {"kd_tree": KDTree, "ball_tree": BallTree}
+LEAF_SIZE = 40
+
+# Bumped when the layout of the saved index changes
+INDEX_VERSION = 1
+
+
+class SimilarityIndex:
+
+    # points are the standardized features of every map, in the order of map_ids
+    def __init__(self, map_ids, columns, mean, scale, points, tree = "kd_tree", leaf_size = LEAF_SIZE):
+        self.map_ids = np.asarray(map_ids).astype(str)
+        self.columns = list(columns)
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+        self.tree_type = tree
+        self.tree = TREES[tree](np.asarray(points, dtype=np.float64), leaf_size=leaf_size)
+        self.rows = {map_id: i for i, map_id in enumerate(self.map_ids)}
+
+    # Function to build an index from a feature table (without map_id), standardizing it first
+    @classmethod
+    def build(cls, map_ids, df, tree = "kd_tree", leaf_size = LEAF_SIZE):
+        from sklearn.preprocessing import StandardScaler
+
+        scaler = StandardScaler()
+        points = scaler.fit_transform(df.to_numpy(dtype=np.float64))
+        return cls.from_scaled(map_ids, df.columns, scaler, points, tree, leaf_size)
+
+    # Function to build an index from features that were already standardized with a fitted StandardScaler
+    @classmethod
+    def from_scaled(cls, map_ids, columns, scaler, points, tree = "kd_tree", leaf_size = LEAF_SIZE):
+        return cls(map_ids, columns, scaler.mean_, scaler.scale_, points, tree, leaf_size)
+
+    def __len__(self):
+        return len(self.map_ids)
+
+    # The trees pickle their arrays as they are, so loading an index does not rebuild anything
+    def save(self, path):
+        with open(path, "wb") as f:
+            pickle.dump({"version": INDEX_VERSION, "map_ids": self.map_ids, "columns": self.columns, "mean": self.mean,
+                         "scale": self.scale, "tree_type": self.tree_type, "tree": self.tree}, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+        if state.get("version") != INDEX_VERSION:
+            raise ValueError(f"{path} was written by another version of the index (rebuild it)")
+
+        index = cls.__new__(cls)
+        for name in ["map_ids", "columns", "mean", "scale", "tree_type", "tree"]:
+            setattr(index, name, state[name])
+        index.rows = {map_id: i for i, map_id in enumerate(index.map_ids)}
+        return index
+
+    # Function to standardize raw feature rows (columns in the order of self.columns)
+    def transform(self, X):
+        return (np.asarray(X, dtype=np.float64) - self.mean) / self.scale
+
+    # Function to find the k nearest maps of every standardized row
+    # returns the map ids and the distances, one row of k per query (closest first)
+    def query_points(self, points, k = NEIGHBORS):
+        k = min(k, len(self))
+        with stats.timer("index.query_time"):
+            distances, rows = self.tree.query(np.atleast_2d(points), k=k)
+        return self.map_ids[rows], distances
+
+    # Function to find the k nearest maps of raw feature rows
+    def query(self, X, k = NEIGHBORS):
+        return self.query_points(self.transform(X), k)
+
+    # Function to find the k maps most similar to maps already in the index (the map itself is left out)
+    def query_ids(self, map_ids, k = NEIGHBORS):
+        unknown = [map_id for map_id in map_ids if map_id not in self.rows]
+        if unknown:
+            raise KeyError(f"Maps not in the index: {unknown}")
+
+        rows = np.array([self.rows[map_id] for map_id in map_ids], dtype=np.int64)
+        points = np.asarray(self.tree.data)[rows]
+        ids, distances = self.query_points(points, k + 1)
+
+        # drop the map itself (or the furthest result if duplicates pushed it out)
+        own = ids == self.map_ids[rows][:, None]
+        drop = np.where(own.any(axis=1), own.argmax(axis=1), ids.shape[1] - 1)
+        keep = np.arange(ids.shape[1])[None, :] != drop[:, None]
+        return ids[keep].reshape(len(rows), -1)[:, :k], distances[keep].reshape(len(rows), -1)[:, :k]
+
+    # Function to find the k maps most similar to .osu files (paths or bytes), features are extracted like the index's
+    def query_maps(self, map_files, k = NEIGHBORS):
+        import feature_extraction
+
+        X = []
+        for map_file, (features, error) in zip(map_files, feature_extraction.extract_features_batch(map_files, self.columns)):
+            if error is not None:
+                raise ValueError(f"Failed to extract features from {map_file}: {error}")
+            X.append([features[c] for c in self.columns])
+        return self.query(X, k)
+
+
+# Function to build an index from a feature file, keeping the same maps and columns as create_clusters.py
+def build_index(input_file, min_difficulty = 5, tree = "kd_tree", leaf_size = LEAF_SIZE):
+    import create_clusters
+
+    with stats.timer("stage.load"):
+        map_ids, df = create_clusters.load_features(input_file, min_difficulty)
+    if len(df) == 0:
+        raise SystemExit(f"No maps to index in {input_file}")
+
+    with stats.timer("stage.build"):
+        index = SimilarityIndex.build(map_ids, df, tree, leaf_size)
+    log.info(f"Indexed {len(index)} maps on {len(index.columns)} features: {index.columns}")
+    return index
+
+
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(description="Find osu! maps similar to a map.")
+    parser.add_argument("--index", default=INDEX_FILE, help="index file")
+    parser.add_argument("--log-level", default=instrumentation.LOG_LEVEL, choices=["DEBUG", "INFO", "WARNING", "ERROR"], type=str.upper)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="build the index from a feature file")
+    build.add_argument("--input", default=config.extraction_file, help="feature file (csv, parquet, feather or npz)")
+    build.add_argument("--min-difficulty", type=float, default=5, help="only index maps with a higher overall difficulty")
+    build.add_argument("--tree", choices=sorted(TREES), default="kd_tree")
+    build.add_argument("--leaf-size", type=int, default=LEAF_SIZE)
+
+    query = commands.add_parser("query", help="print the maps most similar to each map")
+    query.add_argument("maps", nargs="+", help="map ids from the index, or .osu files")
+    query.add_argument("-k", type=int, default=NEIGHBORS, help="maps to print per query")
+    return parser.parse_args(argv)
+
+
+def main(argv = None):
+    args = parse_args(argv)
+    instrumentation.setup_logging(args.log_level)
+
+    if args.command == "build":
+        index = build_index(args.input, args.min_difficulty, args.tree, args.leaf_size)
+        index.save(args.index)
+        log.info(f"Wrote index to {args.index}")
+        return
+
+    start = time.perf_counter()
+    index = SimilarityIndex.load(args.index)
+    log.debug(f"Loaded {len(index)} maps from {args.index} in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    # anything that is a file and not a map id is read as a .osu file
+    files = [m for m in args.maps if m not in index.rows and os.path.isfile(m)]
+    ids = [m for m in args.maps if m not in files]
+
+    start = time.perf_counter()
+    results = {}
+    if ids:
+        results.update(zip(ids, zip(*index.query_ids(ids, args.k))))
+    if files:
+        results.update(zip(files, zip(*index.query_maps(files, args.k))))
+    log.debug(f"Answered {len(args.maps)} queries in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    for m in args.maps:
+        neighbors, distances = results[m]
+        print(f"Maps most similar to {m}:")
+        for rank, (neighbor, distance) in enumerate(zip(neighbors, distances), start=1):
+            print(f"{rank:>4}. {neighbor} ({distance:.3f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+###########################
+# This module generates deterministic synthetic .osu maps (and beatmapset archives) for benchmarks.
+# The same arguments and seed always give the same file, so timings can be compared between versions.
+# Hit objects are laid out in segments of streams (1/4 beat, close together), jumps (1/2 beat, far apart)
+# and plain notes, following the timing points of the map.
+###########################
+
+# Python library imports
+import io
+import os
+import math
+import random
+import zipfile
+
+# File-specific configurations
+HIT_OBJECTS = 200
+BPM = 180
+OVERALL_DIFFICULTY = 8
+STREAM_FRACTION = 0.3 # share of hit objects placed in streams
+JUMP_FRACTION = 0.3 # share of hit objects placed in jumps
+SLIDER_FRACTION = 0.1 # share of plain notes that are sliders
+
+SEGMENT_LENGTHS = (4, 24) # shortest and longest stream/jump/plain segment
+PLAYFIELD = (512, 384)
+START_TIME = 1000 # ms before the first hit object
+
+
+# Function to get the text of a synthetic map
+# timing_points uninherited points (BPM changes spread over the map) and inherited_points green lines in between
+def generate_map(hit_objects = HIT_OBJECTS, timing_points = 1, inherited_points = 0, stream_fraction = STREAM_FRACTION,
+                 jump_fraction = JUMP_FRACTION, slider_fraction = SLIDER_FRACTION, mode = 0,
+                 overall_difficulty = OVERALL_DIFFICULTY, bpm = BPM, seed = 0):
+    rng = random.Random(seed)
+
+    # hit object indices where each uninherited timing point starts, and its beat length
+    changes = [round(i * hit_objects / timing_points) for i in range(max(timing_points, 1))]
+    beat_lengths = [60000 / (bpm * rng.uniform(0.8, 1.25)) if i > 0 else 60000 / bpm for i in range(len(changes))]
+
+    objects = []
+    uninherited = []
+    t = float(START_TIME)
+    x, y = PLAYFIELD[0] // 2, PLAYFIELD[1] // 2
+    change = 0
+    kind, left = "plain", 0
+
+    for i in range(hit_objects):
+        if change < len(changes) and i == changes[change]:
+            uninherited.append((int(t), beat_lengths[change]))
+            change += 1
+        beat_length = uninherited[-1][1]
+
+        # start a new segment
+        if left == 0:
+            roll = rng.random()
+            kind = "stream" if roll < stream_fraction else "jump" if roll < stream_fraction + jump_fraction else "plain"
+            left = rng.randint(*SEGMENT_LENGTHS)
+        left -= 1
+
+        if kind == "stream":
+            step, spacing = beat_length / 4, rng.uniform(15, 40)
+        elif kind == "jump":
+            step, spacing = beat_length / 2, rng.uniform(150, 300)
+        else:
+            step, spacing = beat_length * rng.choice([1, 1, 2]), rng.uniform(40, 200)
+
+        if i > 0:
+            t += step
+            angle = rng.uniform(0, 2 * math.pi)
+            x = int(min(max(x + spacing * math.cos(angle), 0), PLAYFIELD[0]))
+            y = int(min(max(y + spacing * math.sin(angle), 0), PLAYFIELD[1]))
+
+        new_combo = 4 if left == 0 else 0
+        if kind == "plain" and rng.random() < slider_fraction:
+            end_x, end_y = rng.randint(0, PLAYFIELD[0]), rng.randint(0, PLAYFIELD[1])
+            objects.append(f"{x},{y},{int(t)},{2 | new_combo},0,B|{end_x}:{end_y},1,100")
+        else:
+            objects.append(f"{x},{y},{int(t)},{1 | new_combo},0,0:0:0:0:")
+
+    # green lines at random times, each after the red line it belongs to
+    end_time = int(t)
+    inherited = [(rng.randint(START_TIME, max(end_time, START_TIME + 1)), -rng.choice([50, 75, 100, 150, 200]))
+                 for _ in range(inherited_points)]
+
+    lines = ["osu file format v14", "",
+             "[General]", "AudioFilename: audio.mp3", "AudioLeadIn: 0", f"Mode: {mode}", "",
+             "[Metadata]", f"Title:Synthetic {seed}", "Artist:benchmark", "Creator:benchmark", f"Version:{hit_objects} objects", "",
+             "[Difficulty]", "HPDrainRate:5", "CircleSize:4", f"OverallDifficulty:{overall_difficulty}", "ApproachRate:9",
+             "SliderMultiplier:1.4", "SliderTickRate:1", "",
+             "[Events]", "//Background and Video events", '0,0,"bg.jpg",0,0', "",
+             "[TimingPoints]"]
+
+    points = [(time, 0, f"{time},{beat_length!r},4,2,0,100,1,0") for time, beat_length in uninherited]
+    points += [(time, 1, f"{time},{beat_length},4,2,0,100,0,0") for time, beat_length in inherited]
+    lines += [line for _, _, line in sorted(points)]
+    lines += ["", "[HitObjects]"] + objects
+
+    return "\n".join(lines) + "\n"
+
+
+# Function to write a synthetic map to a file (same arguments as generate_map)
+def write_map(map_file, **kwargs):
+    with open(map_file, "w", encoding="utf-8") as f:
+        f.write(generate_map(**kwargs))
+
+
+# Function to fill a folder with count maps named like the fetcher names them (<n>_0.osu)
+# the seed of each map is its number, so growing a corpus keeps the maps already written
+def write_corpus(maps_path, count, start = 0, **kwargs):
+    os.makedirs(maps_path, exist_ok=True)
+    for n in range(start, count):
+        write_map(os.path.join(maps_path, f"{n}_0.osu"), seed=n, **kwargs)
+
+
+# Function to get the bytes of a beatmapset archive (.osz) like the ones the fetcher downloads
+# every difficulty is a dict of generate_map arguments, non-map files are added like in real archives
+def generate_archive(difficulties, seed = 0):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for n, difficulty in enumerate(difficulties):
+            archive.writestr(f"synthetic {seed} [{n}].osu", generate_map(seed=seed * 100 + n, **difficulty))
+        archive.writestr("audio.mp3", bytes(random.Random(seed).getrandbits(8) for _ in range(4096)))
+        archive.writestr("bg.jpg", b"\xff\xd8\xff" + bytes(1024))
+    return buffer.getvalue()
+
+
+# Function to get the difficulties of a typical beatmapset: a spread of overall difficulties,
+# and now and then a taiko/catch/mania difficulty the fetcher has to reject
+def typical_difficulties(count = 5, hit_objects = HIT_OBJECTS, seed = 0):
+    rng = random.Random(seed)
+    return [{"hit_objects": hit_objects, "overall_difficulty": round(rng.uniform(2, 10), 1),
+             "mode": rng.choice([0, 0, 0, 0, 1, 2, 3]), "timing_points": rng.randint(1, 3),
+             "inherited_points": rng.randint(0, 10)} for _ in range(count)]
@@ -0,0 +1,25 @@
+###########################
+# Shared setup for the tests.
+# The scripts read their folders and API settings from config.py, which is not part of the repo,
+# so the tests use a config of their own that points everything at a temporary folder.
+###########################
+
+# Python library imports
+import os
+import sys
+import types
+import tempfile
+
+# the modules are at the top of the repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TEST_FOLDER = tempfile.mkdtemp(prefix="osu_analyzer_tests_")
+
+config = types.ModuleType("config")
+config.map_folder = os.path.join(TEST_FOLDER, "maps") + os.sep
+config.extraction_file = os.path.join(TEST_FOLDER, "extracted_data.csv")
+config.api_link = "http://127.0.0.1:1/d/"
+config.osu_api_client_id = 0
+config.osu_api_client_secret = ""
+config.osu_api_redirect_uri = ""
+sys.modules["config"] = config
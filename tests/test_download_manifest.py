@@ -0,0 +1,63 @@
+###########################
+# Tests for the download manifest (download_manifest.py): which beatmapsets count as handled,
+# and how that survives reopening the manifest.
+###########################
+
+# Python library imports
+import io
+import zipfile
+import map_store
+import synthetic_maps
+import download_manifest
+import fetch_maps
+
+
+# Function to build a beatmapset archive with one difficulty per overall difficulty
+def make_archive(difficulties):
+    content = io.BytesIO()
+    with zipfile.ZipFile(content, "w") as archive:
+        for n, overall_difficulty in enumerate(difficulties):
+            archive.writestr(f"diff {n}.osu", synthetic_maps.generate_map(overall_difficulty=overall_difficulty, seed=n))
+    return content.getvalue()
+
+
+def test_threshold_rejections_are_checked_again(tmp_path, monkeypatch):
+    manifest_file = str(tmp_path / "manifest.sqlite")
+    monkeypatch.setattr(fetch_maps, "store", map_store.open_store(str(tmp_path / "maps"), "flat"))
+    monkeypatch.setattr(fetch_maps, "manifest", download_manifest.Manifest(manifest_file))
+
+    assert fetch_maps.extract_map("1", make_archive([3, 4]), difficulty_threshold=5.0) == 0
+    assert fetch_maps.extract_map("2", make_archive([4, 6]), difficulty_threshold=5.0) == 1
+    assert fetch_maps.extract_map("3", make_archive([6]), difficulty_threshold=5.0) == 1
+    fetch_maps.manifest.close()
+
+    manifest = download_manifest.Manifest(manifest_file)
+    assert manifest.summary() == {download_manifest.REJECTED: 1, download_manifest.ACCEPTED: 2}
+    for map_id in ["1", "2", "3"]:
+        assert manifest.is_done(map_id, 5.0)
+        assert manifest.is_done(map_id, 6.0)
+
+    # a lower threshold could accept difficulties that were left out
+    assert not manifest.is_done("1", 3.5)
+    assert not manifest.is_done("2", 3.5)
+    assert manifest.is_done("3", 3.5)
+
+    # once checked again with the lower threshold, the sets are done for it
+    monkeypatch.setattr(fetch_maps, "manifest", manifest)
+    assert fetch_maps.extract_map("1", make_archive([3, 4]), difficulty_threshold=3.5) == 1
+    assert fetch_maps.extract_map("2", make_archive([4, 6]), difficulty_threshold=3.5) == 2
+    assert manifest.is_done("1", 3.5) and manifest.is_done("2", 3.5)
+    assert manifest.accepted_count() == 4
+    manifest.close()
+
+
+def test_mode_rejections_are_final(tmp_path, monkeypatch):
+    monkeypatch.setattr(fetch_maps, "store", map_store.open_store(str(tmp_path / "maps"), "flat"))
+    monkeypatch.setattr(fetch_maps, "manifest", download_manifest.Manifest(str(tmp_path / "manifest.sqlite")))
+
+    content = io.BytesIO()
+    with zipfile.ZipFile(content, "w") as archive:
+        archive.writestr("taiko.osu", synthetic_maps.generate_map(mode=1))
+    assert fetch_maps.extract_map("1", content.getvalue(), difficulty_threshold=5.0) == 0
+    assert fetch_maps.manifest.is_done("1", 0.0)
+    fetch_maps.manifest.close()
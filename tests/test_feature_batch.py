@@ -0,0 +1,77 @@
+###########################
+# Parity tests for batched feature extraction (feature_batch.py, extract_features_batch).
+# Every map of a batch has to get exactly what extract_features_safe gives it on its own,
+# values, value types and error messages included.
+###########################
+
+# Python library imports
+import os
+import random
+import filecmp
+import pytest
+import synthetic_maps
+import feature_extraction
+
+ALL_FEATURES = feature_extraction.feature_set(*feature_extraction.FEATURE_SETS)
+
+
+# Function to write generated maps covering the edge cases of the batched code
+# (empty and tiny maps, several BPMs, no timing points, hit objects before the first timing point, broken values)
+def write_maps(folder, count = 120):
+    files = []
+    for n in range(count):
+        rng = random.Random(n)
+        hit_objects = rng.choice([0, 1, 2, 3, 50, 500]) if n % 23 != 0 else 50
+        text = synthetic_maps.generate_map(hit_objects=hit_objects, timing_points=rng.randint(1, 5), inherited_points=10, seed=n)
+        if n % 17 == 0:
+            before, after = text.split("[TimingPoints]")
+            text = before + "[TimingPoints]\n\n[HitObjects]" + after.split("[HitObjects]")[1]
+        if n % 19 == 0:
+            text = text.replace("\n1000,", "\n3000,", 1)
+        if n % 23 == 0:
+            text = text.replace("OverallDifficulty:8", "OverallDifficulty:")
+
+        files.append(os.path.join(folder, f"{n}_0.osu"))
+        with open(files[-1], "w", encoding="utf-8") as f:
+            f.write(text)
+    return files
+
+
+@pytest.fixture(scope="module")
+def map_files(tmp_path_factory):
+    return write_maps(str(tmp_path_factory.mktemp("maps")))
+
+
+@pytest.mark.parametrize("features", [None, ALL_FEATURES], ids=["default", "all"])
+@pytest.mark.parametrize("batch_size", [1, 7, 256])
+def test_batch_matches_per_map(map_files, features, batch_size):
+    expected = [feature_extraction.extract_features_safe(f, features) for f in map_files]
+
+    results = []
+    for start in range(0, len(map_files), batch_size):
+        results += feature_extraction.extract_features_batch(map_files[start:start + batch_size], features)
+
+    # repr also tells ints from floats and compares NaN
+    assert [repr(r) for r in results] == [repr(r) for r in expected]
+
+
+# a map with an empty OverallDifficulty fails the batched evaluation, the rest of its batch still gets features
+def test_bad_map_only_fails_itself(map_files):
+    results = feature_extraction.extract_features_batch(map_files)
+    for n, (features, error) in enumerate(results):
+        if n % 23 == 0:
+            assert error == "ValueError: could not convert string to float: ''"
+    assert sum(error is None for features, error in results) > len(map_files) // 2
+
+
+def test_folder_output(tmp_path, map_files):
+    maps_path = os.path.dirname(map_files[0])
+    outputs = []
+    for workers, batch_size in [(1, 1), (1, 256), (2, 16)]:
+        outputs.append(str(tmp_path / f"features_{workers}_{batch_size}.csv"))
+        feature_extraction.extract_features_from_folder(maps_path, workers=workers, output_file=outputs[-1],
+                                                        use_cache=False, features=ALL_FEATURES, batch_size=batch_size)
+
+    for output in outputs[1:]:
+        assert filecmp.cmp(output, outputs[0], shallow=False)
+        assert filecmp.cmp(os.path.splitext(output)[0] + "_errors.csv", os.path.splitext(outputs[0])[0] + "_errors.csv", shallow=False)
@@ -0,0 +1,91 @@
+###########################
+# Tests for the feature cache (feature_cache.py): cached runs have to give the same output as uncached ones,
+# and switching between feature sets must not throw the other set's entries away.
+###########################
+
+# Python library imports
+import os
+import filecmp
+import pytest
+import feature_cache
+import feature_extraction
+from test_map_store import write_flat_store
+
+
+# Function to extract a folder with the cache on and get how many maps were extracted (not cached)
+def extract(maps, output_file, names, **kwargs):
+    extracted = []
+    iter_features = feature_extraction.iter_features
+
+    def counting(*args, **kwargs):
+        for result in iter_features(*args, **kwargs):
+            extracted.append(result)
+            yield result
+
+    feature_extraction.iter_features = counting
+    try:
+        feature_extraction.extract_features_from_folder(maps, output_file=output_file, use_cache=True,
+                                                        features=feature_extraction.feature_set(*names), **kwargs)
+    finally:
+        feature_extraction.iter_features = iter_features
+    return len(extracted)
+
+
+@pytest.mark.parametrize("workers,batch_size", [(1, 1), (1, 8), (2, 1), (2, 8)])
+def test_cached_runs_match_uncached(tmp_path, workers, batch_size):
+    maps = str(tmp_path / "maps")
+    write_flat_store(maps)
+    expected = str(tmp_path / "expected.csv")
+    feature_extraction.extract_features_from_folder(maps, workers=1, output_file=expected, use_cache=False)
+
+    output = str(tmp_path / "cached.csv")
+    assert extract(maps, output, ["current"], workers=workers, batch_size=batch_size) == 30
+    assert filecmp.cmp(expected, output, shallow=False)
+    assert extract(maps, output, ["current"], workers=workers, batch_size=batch_size) == 0
+    assert filecmp.cmp(expected, output, shallow=False)
+
+
+def test_switching_feature_sets_keeps_both(tmp_path):
+    maps = str(tmp_path / "maps")
+    write_flat_store(maps)
+    output = str(tmp_path / "features.csv")
+
+    assert extract(maps, output, ["current"], workers=1) == 30
+    assert extract(maps, output, ["legacy"], workers=1) == 30
+    assert extract(maps, output, ["current"], workers=1) == 0
+    assert extract(maps, output, ["legacy"], workers=1) == 0
+
+
+def test_rewritten_map_is_checked_by_hash(tmp_path):
+    maps = str(tmp_path / "maps")
+    write_flat_store(maps)
+    output = str(tmp_path / "features.csv")
+    extract(maps, output, ["current"], workers=1)
+
+    # same contents with a new mtime stays cached, new contents are extracted again
+    touched = os.path.join(maps, "1_0.osu")
+    os.utime(touched, ns=(0, 0))
+    assert extract(maps, output, ["current"], workers=1) == 0
+
+    changed = os.path.join(maps, "2_0.osu")
+    with open(changed, "rb") as f:
+        data = f.read()
+    with open(changed, "wb") as f:
+        f.write(data.replace(b"Title:", b"Title:X"))
+    assert extract(maps, output, ["current"], workers=1) == 1
+
+
+def test_prune_drops_least_recently_used_versions(tmp_path):
+    cache_file = str(tmp_path / "cache.sqlite")
+    for n in range(4):
+        cache = feature_cache.FeatureCache(cache_file, f"v{n}", keep_versions=2)
+        cache.put("a", (1, 1), None, {"x": n})
+        cache.put("b", (1, 1), None, {"x": n})
+        cache.prune(["a", "b"])
+        cache.close()
+
+    cache = feature_cache.FeatureCache(cache_file, "v3", keep_versions=2)
+    assert cache.prune(["a"]) == 2 # b of v2 and v3
+    assert sorted(v for (v,) in cache.db.execute("SELECT DISTINCT version FROM features")) == ["v2", "v3"]
+    assert cache.lookup("a", (1, 1), None) == ({"x": 3}, None)
+    cache.close()
@@ -0,0 +1,126 @@
+###########################
+# Tests for the pooled download session (http_session.py) and fetch_maps.download_map,
+# run against a local HTTP server standing in for the beatmap mirror.
+###########################
+
+# Python library imports
+import time
+import threading
+import http.server
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import requests
+import http_session
+import download_manifest
+import fetch_maps
+
+
+# Stand-in for the mirror: the path picks the behavior
+#   /ok/<id>: 200, /missing/<id>: 404, /flaky/<id>: 503 twice then 200,
+#   /limited/<id>: 429 with Retry-After: 1 once then 200, /slow/<id>: answers after 1 second
+class MirrorHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.hits[self.path] = server.hits.get(self.path, 0) + 1
+            server.ports.add(self.client_address[1])
+            hits = server.hits[self.path]
+
+        kind = self.path.strip("/").split("/")[0]
+        if kind == "missing":
+            return self.reply(404)
+        if kind == "flaky" and hits <= 2:
+            return self.reply(503)
+        if kind == "limited" and hits <= 1:
+            return self.reply(429, headers={"Retry-After": "1"})
+        if kind == "slow":
+            time.sleep(1)
+        self.reply(200, b"archive " + self.path.encode())
+
+    def reply(self, status, body = b"", headers = {}):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def mirror():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), MirrorHandler)
+    server.daemon_threads = True
+    server.hits = {}
+    server.ports = set()
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+# Function to make a session that retries without sleeping long
+def fast_session(**kwargs):
+    kwargs.setdefault("backoff_factor", 0.01)
+    kwargs.setdefault("backoff_jitter", 0)
+    return http_session.PooledSession(**kwargs)
+
+
+def test_retries_server_errors(mirror):
+    response = fast_session().get(mirror.url + "/flaky/1")
+    assert response.status_code == 200
+    assert response.content == b"archive /flaky/1"
+    assert mirror.hits["/flaky/1"] == 3
+
+
+def test_does_not_retry_client_errors(mirror):
+    response = fast_session().get(mirror.url + "/missing/1")
+    assert response.status_code == 404
+    assert mirror.hits["/missing/1"] == 1
+
+
+def test_gives_up_after_max_retries(mirror):
+    response = fast_session(max_retries=1).get(mirror.url + "/flaky/2")
+    assert response.status_code == 503
+    assert mirror.hits["/flaky/2"] == 2
+
+
+def test_honors_retry_after(mirror):
+    start = time.perf_counter()
+    response = fast_session().get(mirror.url + "/limited/1")
+    assert response.status_code == 200
+    assert time.perf_counter() - start >= 1
+
+
+def test_read_timeout(mirror):
+    with pytest.raises(requests.exceptions.RequestException):
+        fast_session(max_retries=0, timeout=(1, 0.2)).get(mirror.url + "/slow/1")
+
+
+def test_connections_are_pooled(mirror):
+    session = fast_session(pool_size=4)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        responses = list(executor.map(lambda n: session.get(f"{mirror.url}/ok/{n}"), range(100)))
+
+    assert all(response.status_code == 200 for response in responses)
+    # keep-alive: the 100 requests went over at most one connection per pool slot
+    assert len(mirror.ports) <= 4
+
+
+def test_download_map(mirror, tmp_path, monkeypatch):
+    monkeypatch.setattr(fetch_maps.config, "api_link", mirror.url + "/ok/")
+    monkeypatch.setattr(fetch_maps, "session", fast_session())
+    monkeypatch.setattr(fetch_maps, "manifest", download_manifest.Manifest(str(tmp_path / "manifest.sqlite")))
+
+    assert fetch_maps.download_map("123") == b"archive /ok/123"
+
+    # a failed download is recorded in the manifest instead of raising
+    monkeypatch.setattr(fetch_maps.config, "api_link", mirror.url + "/missing/")
+    assert fetch_maps.download_map("456") is None
+    assert fetch_maps.manifest.summary().get(download_manifest.FAILED) == 1
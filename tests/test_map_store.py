@@ -0,0 +1,60 @@
+###########################
+# Tests for the map stores (map_store.py): the same maps have to give the same features
+# whatever layout they are stored in.
+###########################
+
+# Python library imports
+import os
+import filecmp
+import pytest
+import map_store
+import synthetic_maps
+import feature_extraction
+
+
+# Function to fill a flat folder with generated maps, one of them with Latin-1 metadata (not valid UTF-8)
+def write_flat_store(root, count = 30):
+    os.makedirs(root)
+    for n in range(count):
+        text = synthetic_maps.generate_map(hit_objects=100 + n, timing_points=1 + n % 3, seed=n)
+        data = text.encode("utf-8")
+        if n == 3:
+            data = data.replace(b"Title:Synthetic 3", "Title:Café".encode("latin-1"))
+        with open(os.path.join(root, f"{n}_0.osu"), "wb") as f:
+            f.write(data)
+
+
+@pytest.mark.parametrize("layout", ["sharded", "packed"])
+def test_layouts_give_the_same_features(tmp_path, layout):
+    flat = str(tmp_path / "flat")
+    write_flat_store(flat)
+    other = str(tmp_path / layout)
+    map_store.migrate(flat, other, layout)
+
+    outputs = []
+    for root in [flat, other]:
+        outputs.append(str(tmp_path / f"{os.path.basename(root)}.csv"))
+        feature_extraction.extract_features_from_folder(root, workers=1, output_file=outputs[-1], use_cache=False,
+                                                        features=feature_extraction.feature_set("current", "legacy"))
+
+    assert filecmp.cmp(outputs[0], outputs[1], shallow=False)
+    # the Latin-1 map is extracted like every other map
+    assert not os.path.exists(os.path.splitext(outputs[0])[0] + "_errors.csv")
+
+
+def test_errors_file_follows_the_last_run(tmp_path):
+    flat = str(tmp_path / "flat")
+    write_flat_store(flat, count=3)
+    output = str(tmp_path / "features.csv")
+    errors_file = str(tmp_path / "features_errors.csv")
+
+    broken = os.path.join(flat, "9_0.osu")
+    with open(broken, "w") as f:
+        f.write("osu file format v14\n\n[HitObjects]\nnot,a,hit,object\n")
+    feature_extraction.extract_features_from_folder(flat, workers=1, output_file=output, use_cache=False)
+    assert os.path.exists(errors_file)
+
+    # the broken map is gone, so the list of the previous run must not be left behind
+    os.remove(broken)
+    feature_extraction.extract_features_from_folder(flat, workers=1, output_file=output, use_cache=False)
+    assert not os.path.exists(errors_file)
@@ -0,0 +1,42 @@
+###########################
+# Tests for the .osu parser (osu_parser.py): parsing a buffer, or a slice of one, has to give the
+# same sections as parsing the lines of the file.
+###########################
+
+# Python library imports
+import pytest
+import osu_parser
+import synthetic_maps
+
+MAP = synthetic_maps.generate_map(hit_objects=50, timing_points=2, inherited_points=3, seed=1).encode("utf-8")
+
+
+# Function to make the rows of both parsers comparable (comma-separated fields stay bytes in parse_buffer)
+def as_text(parsed):
+    return {name: rows if isinstance(rows, dict) else [[field.decode() if isinstance(field, bytes) else field for field in row] for row in rows]
+            for name, rows in parsed.items()}
+
+
+@pytest.mark.parametrize("sections", [None, ["Difficulty"], ["TimingPoints", "HitObjects"]])
+def test_buffer_matches_lines(sections):
+    expected = osu_parser.parse_sections(MAP.decode().splitlines(), sections)
+    assert as_text(osu_parser.parse_buffer(MAP, sections)) == expected
+
+
+# slices of a larger buffer, starting on the header, on the newline before it or in the middle of the previous map
+@pytest.mark.parametrize("prefix", [b"", b"\n", b"\r\n", b"\n\n", b"previous map\n"])
+def test_slices(prefix):
+    buf = b"x" * 10 + prefix + MAP + b"[next map]\n"
+    start = 10 if prefix != b"previous map\n" else 10 + len(b"previous ")
+    parsed = osu_parser.parse_osu(osu_parser.MappedSlice(buf, start, 10 + len(prefix) + len(MAP)))
+    assert as_text(parsed) == osu_parser.parse_sections(MAP.decode().splitlines())
+
+
+# a slice starting on the newline right before its first header (the first section must not be lost)
+@pytest.mark.parametrize("prefix", [b"\n", b"\n\n"])
+def test_slice_starting_on_newline_before_header(prefix):
+    body = MAP[MAP.index(b"[General]"):]
+    buf = prefix + body
+    parsed = osu_parser.parse_osu(osu_parser.MappedSlice(buf, 0, len(buf)))
+    assert list(parsed)[0] == "General"
+    assert as_text(parsed) == osu_parser.parse_sections(body.decode().splitlines())
@@ -0,0 +1,149 @@
+###########################
+# Parity tests for the vectorized run detection (patterns.py).
+# jump_confidence and stream_confidence have to come out exactly as the per-pair loop
+# that extract_features used before, kept below as the reference.
+###########################
+
+# Python library imports
+import numpy as np
+import pytest
+import beatmap
+import timing
+import patterns
+import synthetic_maps
+import feature_extraction
+
+
+# The loop extract_features used to compute jump_confidence and stream_confidence
+def loop_confidences(hit_distances, time_diffs, hit_beat_lengths, n_hits):
+
+    # Jump features
+    jumps = 0
+    jumps_total = 0
+    small_jumps = 0
+    medium_jumps = 0
+    large_jumps = 0
+
+    jump_lengths = []
+
+    for i in range(len(hit_distances)):
+        if hit_distances[i] > feature_extraction.JUMP_DISTANCE_THRESHOLD and time_diffs[i] < feature_extraction.JUMP_BEAT_THRESHOLD * hit_beat_lengths[i]:
+            jumps += 1
+        else:
+            if jumps >= 12:
+                large_jumps += 1
+            elif jumps >= 8:
+                medium_jumps += 1
+            elif jumps >= 4:
+                small_jumps += 1
+
+            if jumps >= 4:
+                jumps_total += jumps
+                jump_lengths.append(jumps)
+
+            jumps = 0
+
+    jump_density = jumps_total / n_hits
+    total_jumps = small_jumps + medium_jumps + large_jumps
+    large_jumps_density = large_jumps / total_jumps if total_jumps > 0 else 0
+    average_jump_length = sum(jump_lengths) / len(jump_lengths) if len(jump_lengths) > 0 else 0
+    max_jump_length = max(jump_lengths) if len(jump_lengths) > 0 else 0
+
+    jump_confidence = min((jump_density * 0.3)
+    + (large_jumps_density * 0.4)
+    + (min(average_jump_length / 7.0, 1.0) * 0.3)
+    + (min(max_jump_length / 8.0, 1.0) * 0.3)
+    , 1.0)
+
+    # Stream features
+    streams = 0
+    streams_total = 0
+    mini_streams = 0
+    small_streams = 0
+    medium_streams = 0
+    large_streams = 0
+
+    stream_lengths = []
+
+    for i in range(len(hit_distances)):
+        if time_diffs[i] < feature_extraction.STREAM_BEAT_THRESHOLD * hit_beat_lengths[i]:
+            streams += 1
+        else:
+            if streams >= 19:
+                large_streams += 1
+            elif streams >= 13:
+                medium_streams += 1
+            elif streams >= 7:
+                small_streams += 1
+            elif streams >= 3:
+                mini_streams += 1
+
+            if streams >= 3:
+                streams_total += streams
+                stream_lengths.append(streams)
+
+            streams = 0
+
+    stream_density = streams_total / n_hits
+    total_streams = small_streams + medium_streams + large_streams + mini_streams
+    large_streams_density = large_streams / (total_streams) if total_streams > 0 else 0
+    average_stream_length = sum(stream_lengths) / len(stream_lengths) if len(stream_lengths) > 0 else 0
+    max_stream_length = max(stream_lengths) if len(stream_lengths) > 0 else 0
+
+    stream_confidence = min((stream_density * 0.3)
+    + (large_streams_density * 0.4)
+    + (min(average_stream_length / 7.0, 1.0) * 0.3)
+    + (min(max_stream_length / 13.0, 1.0) * 0.3)
+    , 1.0)
+
+    return jump_confidence, stream_confidence
+
+
+# Function to compute both confidences the vectorized way from the same inputs
+def vectorized_confidences(hit_distances, time_diffs, hit_beat_lengths, n_hits):
+    ctx = {"spacing": np.asarray(hit_distances, dtype=np.float64), "time_diffs": np.asarray(time_diffs),
+           "beat_lengths": np.asarray(hit_beat_lengths, dtype=np.float64), "beatmap": range(n_hits)}
+    ctx["jump_mask"] = feature_extraction.jump_mask(ctx)
+    ctx["stream_mask"] = feature_extraction.stream_mask(ctx)
+    return feature_extraction.jump_confidence(ctx), feature_extraction.stream_confidence(ctx)
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_random_masks(seed):
+    rng = np.random.default_rng(seed)
+    n_pairs = int(rng.integers(0, 300))
+
+    # runs of every length, with the masks sometimes still on at the end
+    jumps = rng.random(n_pairs) < rng.uniform(0.2, 0.95)
+    streams = rng.random(n_pairs) < rng.uniform(0.2, 0.95)
+    hit_distances = np.where(jumps, 200.0, 50.0).tolist()
+    time_diffs = np.where(streams, 50, 200).tolist()
+    hit_beat_lengths = [400.0] * n_pairs
+
+    expected = loop_confidences(hit_distances, time_diffs, hit_beat_lengths, n_pairs + 1)
+    assert vectorized_confidences(hit_distances, time_diffs, hit_beat_lengths, n_pairs + 1) == expected
+
+
+@pytest.mark.parametrize("hit_objects", [2, 10, 200, 2000])
+@pytest.mark.parametrize("seed", range(10))
+def test_generated_maps(tmp_path, hit_objects, seed):
+    map_file = str(tmp_path / "map.osu")
+    synthetic_maps.write_map(map_file, hit_objects=hit_objects, timing_points=1 + seed % 4, inherited_points=10,
+                             stream_fraction=0.1 * (seed % 5), jump_fraction=0.4, seed=seed)
+
+    bm = beatmap.load_beatmap(map_file)
+    hit_beat_lengths = timing.TimingIndex.from_beatmap(bm).beat_length_at(bm.time[:-1])
+    expected = loop_confidences(bm.spacing().tolist(), bm.time_diffs().tolist(), hit_beat_lengths.tolist(), len(bm))
+
+    features = feature_extraction.extract_features(map_file, ["jump_confidence", "stream_confidence"])
+    assert (features["jump_confidence"], features["stream_confidence"]) == expected
+
+
+def test_find_runs():
+    starts, lengths = patterns.find_runs([True, True, False, True, False, False, True, True, True])
+    assert starts.tolist() == [0, 3, 6]
+    assert lengths.tolist() == [2, 1, 3]
+
+    # a run going on until the end is not closed
+    assert patterns.closed_run_lengths(np.array([True, False, True, True])).tolist() == [1]
+    assert patterns.closed_run_lengths(np.array([], dtype=bool)).tolist() == []
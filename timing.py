@@ -0,0 +1,43 @@
+###########################
+# This module looks up the beat length (and BPM) active at any time in a map.
+# Uninherited timing points are filtered and sorted once, then every lookup is a binary search.
+###########################
+
+# Python library imports
+import numpy as np
+
+
+class TimingIndex:
+    __slots__ = ("times", "beat_lengths")
+
+    def __init__(self, tp_time, beat_length):
+        tp_time = np.asarray(tp_time, dtype=np.float64)
+        beat_length = np.asarray(beat_length, dtype=np.float64)
+
+        # only uninherited timing points (positive beat length) change the BPM
+        uninherited = beat_length > 0
+        order = np.argsort(tp_time[uninherited], kind="stable")
+        self.times = tp_time[uninherited][order]
+        self.beat_lengths = beat_length[uninherited][order]
+
+    @classmethod
+    def from_beatmap(cls, bm):
+        return cls(bm.tp_time, bm.beat_length)
+
+    def __len__(self):
+        return len(self.times)
+
+    # Beat length active at each of the given times (in ms)
+    # times before the first timing point use the first timing point, NaN if the map has none
+    def beat_length_at(self, times):
+        times = np.asarray(times)
+        if len(self.times) == 0:
+            return np.full(times.shape, np.nan)
+
+        idx = np.searchsorted(self.times, times, side="right") - 1
+        np.maximum(idx, 0, out=idx)
+        return self.beat_lengths[idx]
+
+    # BPM active at each of the given times (in ms)
+    def bpm_at(self, times):
+        return 60000.0 / self.beat_length_at(times)